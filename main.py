@@ -26,35 +26,46 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client
 
 from plugins import glovar
-from plugins.functions.timers import backup_files, interval_min_10, interval_min_15, reset_data, send_count
-from plugins.functions.timers import update_admins, update_status
+from plugins.functions.file import save_counts
+from plugins.functions.timers import backup_files, interval_min_1, interval_min_10, interval_min_15, reset_data
+from plugins.functions.timers import send_count, update_admins, update_status
+from plugins.functions.worker import pool_start
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
-# Config session
-app = Client(
-    session_name="bot",
-    bot_token=glovar.bot_token
-)
-app.start()
-
-# Send online status
-update_status(app, "online")
-
-# Timer
-scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
-scheduler.add_job(interval_min_10, "interval", minutes=10)
-scheduler.add_job(interval_min_15, "interval", [app], minutes=15)
-scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
-scheduler.add_job(backup_files, "cron", [app], hour=20)
-scheduler.add_job(send_count, "cron", [app], hour=21)
-scheduler.add_job(reset_data, "cron", [app], day=glovar.date_reset, hour=22)
-scheduler.add_job(update_admins, "cron", [app], hour=22, minute=30)
-scheduler.start()
-
-# Hold
-app.idle()
-
-# Stop
-app.stop()
+# The worker processes import this script again
+if __name__ == "__main__":
+    # Start the worker processes
+    pool_start()
+
+    # Config session
+    app = Client(
+        session_name="bot",
+        bot_token=glovar.bot_token
+    )
+    app.start()
+
+    # Send online status
+    update_status(app, "online")
+
+    # Timer
+    scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
+    scheduler.add_job(interval_min_1, "interval", [app], minutes=1)
+    scheduler.add_job(interval_min_10, "interval", minutes=10)
+    scheduler.add_job(interval_min_15, "interval", [app], minutes=15)
+    scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
+    scheduler.add_job(backup_files, "cron", [app], hour=20)
+    scheduler.add_job(send_count, "cron", [app], hour=21)
+    scheduler.add_job(reset_data, "cron", [app], day=glovar.date_reset, hour=22)
+    scheduler.add_job(update_admins, "cron", [app], hour=22, minute=30)
+    scheduler.start()
+
+    # Hold
+    app.idle()
+
+    # Stop
+    app.stop()
+
+    # Save the regex hit counts
+    save_counts(True)
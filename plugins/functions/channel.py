@@ -24,8 +24,8 @@ from pyrogram import Chat, Client, Message, User
 from pyrogram.errors import FloodWait
 
 from .. import glovar
-from .etc import code, code_block, general_link, get_forward_name, get_full_name, get_md5sum, get_text, lang
-from .etc import message_link, thread, wait_flood
+from .etc import code, code_block, general_link, get_fields, get_forward_name, get_full_name, get_text, get_text_view
+from .etc import lang, message_link, thread, wait_flood
 from .file import crypt_file, data_to_file, delete_file, get_new_path, save
 from .telegram import get_group_info, send_document, send_message
 
@@ -226,6 +226,11 @@ def get_content(message: Message) -> str:
         if not message:
             return ""
 
+        fields = get_fields(message)
+
+        if "content" in fields:
+            return fields["content"]
+
         text = get_text(message)
 
         if message.audio:
@@ -238,7 +243,9 @@ def get_content(message: Message) -> str:
             result += message.sticker.file_id
 
         if text:
-            result += get_md5sum("string", text)
+            result += get_text_view(text, "md5")
+
+        fields["content"] = result
     except Exception as e:
         logger.warning(f"Get content error: {e}", exc_info=True)
 
@@ -394,13 +401,18 @@ def share_data_thread(client: Client, receivers: List[str], action: str, action_
 def share_regex_count(client: Client, word_type: str) -> bool:
     # Use this function to share regex count to REGEX
     try:
+        # The profiled costs are cleared for every word type
+        costs = glovar.rules.pop_costs(word_type)
+
         if not glovar.regex.get(word_type):
             return True
 
-        if not eval(f"glovar.{word_type}_words"):
+        words = glovar.rules.get_words(word_type)
+
+        if not words:
             return True
 
-        file = data_to_file(eval(f"glovar.{word_type}_words"))
+        file = data_to_file(words)
         share_data(
             client=client,
             receivers=["REGEX"],
@@ -410,6 +422,20 @@ def share_regex_count(client: Client, word_type: str) -> bool:
             file=file
         )
 
+        # Share the profiled costs of the rules, REGEX ignores them until it handles them
+        if not costs:
+            return True
+
+        file = data_to_file(costs)
+        share_data(
+            client=client,
+            receivers=["REGEX"],
+            action="regex",
+            action_type="cost",
+            data=f"{word_type}_cost",
+            file=file
+        )
+
         return True
     except Exception as e:
         logger.warning(f"Share regex update error: {e}", exc_info=True)
@@ -0,0 +1,285 @@
+# SCP-079-LANG - Ban or delete by detecting the language
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LANG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from math import exp, log
+from queue import Empty, Full
+from typing import List, Optional, Set, Tuple
+from unicodedata import name
+
+from guess_language import guess_language
+from langdetect.detector import Detector
+from langdetect.utils.ngram import NGram
+
+from .. import glovar
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def get_char_script(char: str) -> str:
+    # Get the script name of a letter
+    result = ""
+
+    try:
+        result = glovar.script_chars.get(char)
+
+        if result is not None:
+            return result
+
+        words = name(char, "").split()
+
+        if words and words[0] in {"FULLWIDTH", "HALFWIDTH"}:
+            words = words[1:]
+
+        result = (words and words[0]) or ""
+
+        if result.startswith(("HIRAGANA", "KATAKANA")):
+            result = "KANA"
+
+        glovar.script_chars[char] = result
+    except Exception as e:
+        logger.warning(f"Get char script error: {e}", exc_info=True)
+
+    return result
+
+
+def get_detector() -> Optional[Detector]:
+    # Get an idle langdetect detector from the pool
+    result = None
+
+    try:
+        result = glovar.detector_pool.get_nowait()
+    except Empty:
+        result = glovar.detector_factory.create()
+    except Exception as e:
+        logger.warning(f"Get detector error: {e}", exc_info=True)
+
+    return result
+
+
+def get_lang_guess(text: str) -> str:
+    # Get language using guess
+    result = ""
+
+    try:
+        result = guess_language(text)
+
+        if not result or (result != "UNKNOWN" and result in glovar.lang_protect):
+            return ""
+    except Exception as e:
+        logger.info(f"Get lang guess error: {e}", exc_info=True)
+
+    return result
+
+
+def get_lang_langdetect(text: str) -> str:
+    # Get language using langdetect
+    result = ""
+    detector = None
+
+    try:
+        detector = get_detector()
+        detector.append(text)
+        result = detector.detect()
+
+        if not result or result in glovar.lang_protect:
+            return ""
+    except Exception as e:
+        logger.info(f"Get lang langdetect error: {e}", exc_info=True)
+    finally:
+        put_detector(detector)
+
+    return result
+
+
+def get_lang_ngram(scores: List[Tuple[str, float]], threshold: float = 0.0) -> str:
+    # Get language from the n-gram scorer's ranked probabilities
+    result = ""
+
+    try:
+        if not scores or scores[0][1] < threshold:
+            return ""
+
+        result = scores[0][0]
+
+        if result in glovar.lang_protect:
+            return ""
+    except Exception as e:
+        logger.info(f"Get lang ngram error: {e}", exc_info=True)
+
+    return result
+
+
+def get_lang_script(text: str, wanted: Set[str] = None) -> Optional[str]:
+    # Get language by the text's script, return None if the script is ambiguous
+    result = None
+
+    try:
+        script, share = get_script(text)
+
+        if not script or share < 0.9:
+            return None
+
+        codes = glovar.scripts.get(script)
+
+        if codes is None:
+            return None
+
+        # Unconfigured or protected script
+        codes = codes & (glovar.lang_all | glovar.lang_protect)
+
+        if not codes - glovar.lang_protect:
+            return ""
+
+        # None of the wanted languages uses this script
+        if wanted is not None and not codes & wanted:
+            return ""
+
+        # Only one configured language uses this script
+        if len(codes) == 1:
+            return codes.pop()
+    except Exception as e:
+        logger.warning(f"Get lang script error: {e}", exc_info=True)
+
+    return result
+
+
+def get_ngram_codes() -> List[str]:
+    # Get the language codes of the bundled profiles
+    result = []
+
+    try:
+        result = [code.split("-")[0] for code in glovar.detector_factory.langlist]
+    except Exception as e:
+        logger.warning(f"Get ngram codes error: {e}", exc_info=True)
+
+    return result
+
+
+def get_ngram_scores(text: str, limit: int = 1000, n_max: int = NGram.N_GRAM,
+                     langs: Set[str] = None) -> List[Tuple[str, float]]:
+    # Score the profiles by the sum of the text's n-gram log probabilities, return the ranked probabilities
+    result = []
+
+    try:
+        word_lang_prob_map = glovar.detector_factory.word_lang_prob_map
+        codes = get_ngram_codes()
+
+        # Only score the given languages
+        if langs is None:
+            indexes = list(range(len(codes)))
+        else:
+            indexes = [i for i, code in enumerate(codes) if code in langs]
+
+        if not indexes:
+            return []
+
+        # Extract n-grams
+        grams = []
+        ngram = NGram()
+
+        for t in NGram.normalize_vi(text):
+            ngram.add_char(t)
+
+            if ngram.capitalword:
+                continue
+
+            for n in range(1, n_max + 1):
+                w = ngram.get(n)
+
+                if w and w != " " and w in word_lang_prob_map:
+                    grams.append(w)
+
+            if len(grams) >= limit:
+                break
+
+        if not grams:
+            return []
+
+        # Score, smooth the unseen n-grams like langdetect does
+        weight = 0.5 / 10000
+        scores = [0.0] * len(indexes)
+
+        for w in grams:
+            probs = word_lang_prob_map[w]
+            scores = [s + log(probs[i] + weight) for s, i in zip(scores, indexes)]
+
+        # Normalize to probabilities
+        top = max(scores)
+        probs = [exp(s - top) for s in scores]
+        total = sum(probs)
+        merged = {}
+
+        for i, prob in zip(indexes, probs):
+            merged[codes[i]] = merged.get(codes[i], 0.0) + prob / total
+
+        result = sorted(merged.items(), key=lambda x: x[1], reverse=True)
+    except Exception as e:
+        logger.warning(f"Get ngram scores error: {e}", exc_info=True)
+
+    return result
+
+
+def get_script(text: str) -> Tuple[str, float]:
+    # Get the dominant script of the text's letters, and its share
+    script = ""
+    share = 0.0
+
+    try:
+        counts = {}
+
+        for t in text:
+            if not t.isalpha():
+                continue
+
+            char_script = get_char_script(t)
+            counts[char_script] = counts.get(char_script, 0) + 1
+
+        if not counts:
+            return "", 0.0
+
+        # Chinese characters in Japanese text
+        if "KANA" in counts:
+            counts["KANA"] += counts.pop("CJK", 0)
+
+        script = max(counts, key=lambda x: counts[x])
+        share = counts[script] / sum(counts.values())
+    except Exception as e:
+        logger.warning(f"Get script error: {e}", exc_info=True)
+
+    return script, share
+
+
+def put_detector(detector: Optional[Detector]) -> bool:
+    # Reset a detector and return it to the pool
+    try:
+        if not detector:
+            return True
+
+        detector.text = ""
+        detector.langprob = None
+        glovar.detector_pool.put_nowait(detector)
+
+        return True
+    except Full:
+        return True
+    except Exception as e:
+        logger.warning(f"Put detector error: {e}", exc_info=True)
+
+    return False
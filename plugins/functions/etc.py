@@ -26,18 +26,17 @@ from random import choice, uniform
 from string import ascii_letters, digits, punctuation
 from threading import Thread, Timer
 from time import localtime, sleep, strftime, time
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
 from unicodedata import normalize
 
 from cryptography.fernet import Fernet
-from guess_language import guess_language
-from langdetect import detect
-from opencc import convert
-from pyrogram import InlineKeyboardMarkup, Message, MessageEntity, User
+from pyrogram import Client, InlineKeyboardMarkup, Message, MessageEntity, User
 from pyrogram.errors import FloodWait
-from textblob import TextBlob
 
 from .. import glovar
+from .detect import get_lang_guess, get_lang_langdetect, get_lang_ngram, get_lang_script, get_ngram_scores
+from .regex import get_tokens
+from .worker import pool_run
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -204,6 +203,77 @@ def get_command_type(message: Message) -> str:
     return result
 
 
+def get_detection(text: str, tier: int = 0, wanted: Set[str] = None) -> Dict[str, str]:
+    # Get text's detection,
+    # skip the detection if the script cannot be any of the wanted languages,
+    # do less work on higher load tiers: 1 no recheck, 2 script only, 3 cache only
+    result = {
+        "lang": ""
+    }
+
+    try:
+        # Remove unnecessary strings
+        text = get_text_view(text, "stripped")
+
+        if not text.strip():
+            return result
+
+        # Check the script
+        script_lang = None
+
+        if tier < 3:
+            script_lang = get_lang_script(text, wanted)
+
+        if script_lang is not None:
+            result["lang"] = script_lang
+            return result
+
+        # Check the cache, accept the results of lower tiers
+        md5sum = get_md5sum("string", text)
+
+        cached = get_lang_cache([f"{md5sum} {cached_tier}" for cached_tier in range(min(tier, 1) + 1)])
+
+        if cached is not None:
+            return cached
+
+        # Do not detect on high load
+        if tier >= 2:
+            return result
+
+        # Detect
+        detection = pool_run(get_lang_detect, (text, tier))
+
+        # Do not cache a failed detection
+        if detection is None:
+            return result
+
+        result = detection
+
+        # Update the cache
+        set_lang_cache(f"{md5sum} {tier}", result)
+    except Exception as e:
+        logger.warning(f"Get detection error: {e}", exc_info=True)
+
+    return result
+
+
+def get_detections(texts: Iterable[str], tier: int = 0,
+                   wanted: Set[str] = None) -> Dict[str, Dict[str, str]]:
+    # Get the detections of several texts, detect each distinct text once
+    result = {}
+
+    try:
+        for text in texts:
+            if not text or text in result:
+                continue
+
+            result[text] = get_detection(text, tier, wanted)
+    except Exception as e:
+        logger.warning(f"Get detections error: {e}", exc_info=True)
+
+    return result
+
+
 def get_entity_text(message: Message, entity: MessageEntity) -> str:
     # Get a message's entity text
     result = ""
@@ -223,10 +293,42 @@ def get_entity_text(message: Message, entity: MessageEntity) -> str:
     return result
 
 
+def get_fields(obj: Union[Message, User]) -> Dict[str, Any]:
+    # Get the derived fields of a message or user in the current update, each field is computed once per update
+    result = {}
+    try:
+        if not obj:
+            return {}
+
+        # Fields are only kept while a check runs in this thread
+        cache = getattr(glovar.fields, "cache", None)
+
+        if cache is None:
+            return {}
+
+        item = cache.get(id(obj))
+
+        if item is None or item[0] is not obj:
+            item = (obj, {})
+            cache[id(obj)] = item
+
+        result = item[1]
+    except Exception as e:
+        logger.warning(f"Get fields error: {e}", exc_info=True)
+
+    return result
+
+
 def get_filename(message: Message, normal: bool = False, printable: bool = False) -> str:
     # Get file's filename
     text = ""
     try:
+        fields = get_fields(message)
+        key = f"filename {normal} {printable}"
+
+        if key in fields:
+            return fields[key]
+
         if message.document:
             if message.document.file_name:
                 text += message.document.file_name
@@ -236,6 +338,8 @@ def get_filename(message: Message, normal: bool = False, printable: bool = False
 
         if text:
             text = t2t(text, normal, printable)
+
+        fields[key] = text
     except Exception as e:
         logger.warning(f"Get filename error: {e}", exc_info=True)
 
@@ -246,6 +350,12 @@ def get_forward_name(message: Message, normal: bool = False, printable: bool = F
     # Get forwarded message's origin sender's name
     text = ""
     try:
+        fields = get_fields(message)
+        key = f"forward_name {normal} {printable}"
+
+        if key in fields:
+            return fields[key]
+
         if message.forward_from:
             user = message.forward_from
             text = get_full_name(user, normal, printable)
@@ -257,6 +367,8 @@ def get_forward_name(message: Message, normal: bool = False, printable: bool = F
 
         if text:
             text = t2t(text, normal, printable)
+
+        fields[key] = text
     except Exception as e:
         logger.warning(f"Get forward name error: {e}", exc_info=True)
 
@@ -270,6 +382,12 @@ def get_full_name(user: User, normal: bool = False, printable: bool = False) ->
         if not user or user.is_deleted:
             return ""
 
+        fields = get_fields(user)
+        key = f"full_name {normal} {printable}"
+
+        if key in fields:
+            return fields[key]
+
         text = user.first_name
 
         if user.last_name:
@@ -277,6 +395,8 @@ def get_full_name(user: User, normal: bool = False, printable: bool = False) ->
 
         if text and normal:
             text = t2t(text, normal, printable)
+
+        fields[key] = text
     except Exception as e:
         logger.warning(f"Get full name error: {e}", exc_info=True)
 
@@ -295,99 +415,94 @@ def get_int(text: str) -> Optional[int]:
     return result
 
 
-def get_lang(text: str, flood: bool = False) -> str:
+def get_lang(text: str, tier: int = 0, wanted: Set[str] = None) -> str:
     # Get text's language code
     result = ""
 
     try:
-        # Remove unnecessary strings
-        chinese_symbols = "～！、，。？￥…×—·．：；“”‘’（）〈〉《》「」『』【】〔〕"
-        english_symbols = punctuation
-        special_symbols = "£"
-        symbols = chinese_symbols + english_symbols + special_symbols
-        text = "".join(t for t in text if t not in symbols and t not in glovar.emoji_set)
+        result = get_detection(text, tier, wanted)["lang"]
+    except Exception as e:
+        logger.warning(f"Get lang error: {e}", exc_info=True)
 
-        # Avoid short name
-        if len(text) < 20:
-            text = "".join(t for t in text if t.isprintable())
+    return result
 
-            if not text.strip():
-                return ""
 
-            text = text * (20 // len(text) + 1)
+def get_lang_cache(keys: List[str]) -> Optional[Dict[str, str]]:
+    # Get the cached detection of the first cached key, None if no key is cached, count it as one lookup
+    result = None
 
-        # Detect
-        if not text.strip():
-            return ""
+    try:
+        lang_default = glovar.lang_bio | glovar.lang_name | glovar.lang_sticker | glovar.lang_text
+        sign = (frozenset(glovar.lang_protect), frozenset(lang_default))
+        now = time()
 
-        # Init
-        recheck = ""
+        with glovar.locks["lang"]:
+            # Invalidate the cache if the language settings changed
+            if sign != glovar.lang_cache_sign:
+                glovar.lang_cache.clear()
+                glovar.lang_cache_sign = sign
 
-        # Use langdetect, use textblob to recheck
-        result = get_lang_langdetect(text)
+            for key in keys:
+                cached = glovar.lang_cache.get(key)
 
-        if result and not flood:
-            recheck = get_lang_textblob(text)
+                if cached and cached[1] > now:
+                    glovar.lang_cache.move_to_end(key)
+                    glovar.lang_cache_count["hit"] += 1
+                    return cached[0]
 
-        lang_default = glovar.lang_bio | glovar.lang_name | glovar.lang_sticker | glovar.lang_text
+                cached and glovar.lang_cache.pop(key, None)
 
-        if result and flood:
-            return result
-        if result and recheck and (result == recheck or recheck not in lang_default):
-            return recheck
-        elif result:
-            return ""
-
-        # Use guess
-        result = get_lang_guess(text)
+            glovar.lang_cache_count["miss"] += 1
     except Exception as e:
-        logger.warning(f"Get lang error: {e}", exc_info=True)
+        logger.warning(f"Get lang cache error: {e}", exc_info=True)
 
     return result
 
 
-def get_lang_guess(text: str) -> str:
-    # Get language using guess
-    result = ""
+def get_lang_detect(text: str, tier: int = 0) -> Dict[str, str]:
+    # Get stripped text's detection using the detectors
+    result = {
+        "lang": ""
+    }
 
     try:
-        result = guess_language(text)
-
-        if not result or (result != "UNKNOWN" and result in glovar.lang_protect):
-            return ""
-    except Exception as e:
-        logger.info(f"Get lang guess error: {e}", exc_info=True)
-
-    return result
+        # Use the short text classifier
+        if len(text) < 20:
+            text = "".join(t for t in text if t.isprintable())
 
+            if not text.strip():
+                return result
 
-def get_lang_langdetect(text: str) -> str:
-    # Get language using langdetect
-    result = ""
+            scores = get_ngram_scores(text, n_max=2, langs=glovar.lang_all | glovar.lang_protect)
+            result["lang"] = get_lang_ngram(scores, glovar.lang_prob)
 
-    try:
-        result = detect(text)
+            return result
 
-        if not result or result in glovar.lang_protect:
-            return ""
-    except Exception as e:
-        logger.info(f"Get lang langdetect error: {e}", exc_info=True)
+        # Detect
+        if not text.strip():
+            return result
 
-    return result
+        # Init
+        recheck = ""
 
+        # Use langdetect, use the n-gram scorer to recheck
+        the_lang = get_lang_langdetect(text)
 
-def get_lang_textblob(text: str) -> str:
-    # Get language using textblob
-    result = ""
+        if the_lang and tier == 0:
+            scores = get_ngram_scores(text)
+            recheck = get_lang_ngram(scores)
 
-    try:
-        b = TextBlob(text)
-        result = b.detect_language()
+        lang_default = glovar.lang_bio | glovar.lang_name | glovar.lang_sticker | glovar.lang_text
 
-        if not result or result in glovar.lang_protect:
-            return ""
+        if the_lang and tier >= 1:
+            result["lang"] = the_lang
+        elif the_lang and recheck and (the_lang == recheck or recheck not in lang_default):
+            result["lang"] = recheck
+        elif not the_lang:
+            # Use guess
+            result["lang"] = get_lang_guess(text)
     except Exception as e:
-        logger.info(f"Get lang textblob error: {e}", exc_info=True)
+        logger.warning(f"Get lang detect error: {e}", exc_info=True)
 
     return result
 
@@ -396,6 +511,11 @@ def get_links(message: Message) -> List[str]:
     # Get a message's links
     result = []
     try:
+        fields = get_fields(message)
+
+        if "links" in fields:
+            return list(fields["links"])
+
         entities = message.entities or message.caption_entities
 
         if entities:
@@ -433,6 +553,8 @@ def get_links(message: Message) -> List[str]:
                         continue
 
                     result.append(url)
+
+        fields["links"] = tuple(result)
     except Exception as e:
         logger.warning(f"Get links error: {e}", exc_info=True)
 
@@ -562,6 +684,52 @@ def get_report_record(message: Message) -> Dict[str, str]:
     return record
 
 
+def get_scanned_texts(limit: int = 100) -> List[str]:
+    # Get the views of the recently scanned texts, to probe the new rules with
+    result = []
+    try:
+        with glovar.locks["scan"]:
+            texts = [key[2] for key in glovar.regex_scans][-limit:]
+
+        for text in dict.fromkeys(texts):
+            result += [get_text_view(text, "collapsed"), get_text_view(text, "spaceless")]
+
+        result = [text for text in dict.fromkeys(result) if text]
+    except Exception as e:
+        logger.warning(f"Get scanned texts error: {e}", exc_info=True)
+
+    return result
+
+
+def get_simplified(text: str) -> str:
+    # Convert the text to Simplified Chinese, remember the short ones
+    result = text
+    try:
+        if not glovar.opencc or not text:
+            return text
+
+        short = len(text) <= 64
+
+        with glovar.locks["opencc"]:
+            if short and text in glovar.opencc_cache:
+                glovar.opencc_cache.move_to_end(text)
+                return glovar.opencc_cache[text]
+
+            result = glovar.opencc.convert(text) or text
+
+            if not short or glovar.limit_view <= 0:
+                return result
+
+            glovar.opencc_cache[text] = result
+
+            while len(glovar.opencc_cache) > glovar.limit_view:
+                glovar.opencc_cache.popitem(last=False)
+    except Exception as e:
+        logger.warning(f"Get simplified error: {e}", exc_info=True)
+
+    return result
+
+
 def get_stripped_link(link: str) -> str:
     # Get stripped link
     result = ""
@@ -582,6 +750,20 @@ def get_stripped_link(link: str) -> str:
     return result
 
 
+def get_tier(gid: int = 0) -> int:
+    # Get the load tier of a group, flooded groups skip the recheck
+    result = 0
+    try:
+        result = glovar.tier["level"]
+
+        if gid in glovar.flooded_ids:
+            result = max(result, 1)
+    except Exception as e:
+        logger.warning(f"Get tier error: {e}", exc_info=True)
+
+    return result
+
+
 def get_text(message: Message, normal: bool = False, printable: bool = False) -> str:
     # Get message's text
     text = ""
@@ -589,6 +771,12 @@ def get_text(message: Message, normal: bool = False, printable: bool = False) ->
         if not message:
             return ""
 
+        fields = get_fields(message)
+        key = f"text {normal} {printable}"
+
+        if key in fields:
+            return fields[key]
+
         the_text = message.text or message.caption
 
         if the_text:
@@ -596,12 +784,115 @@ def get_text(message: Message, normal: bool = False, printable: bool = False) ->
 
         if text:
             text = t2t(text, normal, printable)
+
+        fields[key] = text
     except Exception as e:
         logger.warning(f"Get text error: {e}", exc_info=True)
 
     return text
 
 
+def get_text_view(text: str, view: str) -> Union[str, Dict[str, int]]:
+    # Get a view of the text, each view of a text is computed at most once
+    result = ""
+    try:
+        # The normalized views depend on the special characters, keep them for the current rules only
+        key = f"{view} {glovar.rules.generation}" if view.startswith("normal") else view
+
+        with glovar.locks["view"]:
+            views = glovar.text_views.get(text)
+
+            if views is not None:
+                glovar.text_views.move_to_end(text)
+
+            if views is not None and key in views:
+                return views[key]
+
+        result = get_text_view_value(text, view)
+
+        if glovar.limit_view <= 0:
+            return result
+
+        with glovar.locks["view"]:
+            views = glovar.text_views.setdefault(text, {})
+            views[key] = result
+            glovar.text_views.move_to_end(text)
+
+            while len(glovar.text_views) > glovar.limit_view:
+                glovar.text_views.popitem(last=False)
+    except Exception as e:
+        logger.warning(f"Get text view error: {e}", exc_info=True)
+
+    return result
+
+
+def get_text_view_value(text: str, view: str) -> Union[str, Dict[str, int]]:
+    # Compute a view of the text, views are built on the shorter views
+    result = ""
+    try:
+        words = view.split()
+        base = " ".join(words[:-1])
+
+        if base:
+            base_text = get_text_view(text, base)
+        else:
+            base_text = text
+
+        # Simplified Chinese
+        if words[-1] == "simplified":
+            result = get_simplified(base_text)
+
+        # Printable characters only
+        elif words[-1] == "printable":
+            result = "".join(t for t in base_text if t.isprintable() or t in {"\n", "\r", "\t"})
+
+        # Special characters replaced, NFKC normalized
+        elif view == "normal":
+            result = normalize("NFKC", text.translate(glovar.rules.translation))
+
+        # Consecutive whitespace collapsed to a single space
+        elif view == "collapsed":
+            result = re.sub(r"\s{2,}", " ", text)
+
+        # Whitespace removed if the collapsed text has any space
+        elif view == "spaceless":
+            collapsed = get_text_view(text, "collapsed")
+            result = re.sub(r"\s", "", collapsed) if " " in collapsed else ""
+
+        # Symbols and emoji removed
+        elif view == "stripped":
+            chinese_symbols = "～！、，。？￥…×—·．：；“”‘’（）〈〉《》「」『』【】〔〕"
+            english_symbols = punctuation
+            special_symbols = "£"
+            symbols = chinese_symbols + english_symbols + special_symbols
+            result = "".join(t for t in text if t not in symbols and t not in glovar.emoji_set)
+
+        # Emoji counts
+        elif view == "emoji":
+            emoji_counts = get_tokens(glovar.emoji_tokenizer, text)
+            result = {emoji: emoji_counts[emoji] for emoji in emoji_counts if emoji not in glovar.emoji_protect}
+
+        # MD5 hash
+        elif view == "md5":
+            result = get_md5sum("string", text)
+    except Exception as e:
+        logger.warning(f"Get text view value error: {e}", exc_info=True)
+
+    return result
+
+
+def init_fields(enable: bool = True) -> bool:
+    # Start keeping the derived fields of a new update in this thread, or stop keeping them
+    try:
+        glovar.fields.cache = {} if enable else None
+
+        return True
+    except Exception as e:
+        logger.warning(f"Init fields error: {e}", exc_info=True)
+
+    return False
+
+
 def lang(text: str) -> str:
     # Get the text
     result = ""
@@ -647,23 +938,40 @@ def random_str(i: int) -> str:
     return text
 
 
+def set_lang_cache(key: str, result: Dict[str, str]) -> bool:
+    # Cache a text's detection
+    try:
+        if glovar.limit_cache <= 0:
+            return True
+
+        with glovar.locks["lang"]:
+            glovar.lang_cache[key] = (result, time() + glovar.time_cache)
+            glovar.lang_cache.move_to_end(key)
+
+            while len(glovar.lang_cache) > glovar.limit_cache:
+                glovar.lang_cache.popitem(last=False)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set lang cache error: {e}", exc_info=True)
+
+    return False
+
+
 def t2t(text: str, normal: bool, printable: bool, simplified: bool = False) -> str:
     # Convert the string, text to text
     try:
         if not text:
             return ""
 
-        if normal:
-            for special in ["spc", "spe"]:
-                text = "".join(eval(f"glovar.{special}_dict").get(t, t) for t in text)
-
-            text = normalize("NFKC", text)
+        view = " ".join(v for v, enabled in [("normal", normal),
+                                             ("printable", printable),
+                                             ("simplified", normal or simplified)] if enabled)
 
-        if printable:
-            text = "".join(t for t in text if t.isprintable() or t in {"\n", "\r", "\t"})
+        if not view:
+            return text
 
-        if (normal or simplified) and glovar.zh_cn:
-            text = convert(text, config="t2s.json")
+        text = get_text_view(text, view)
     except Exception as e:
         logger.warning(f"T2T error: {e}", exc_info=True)
 
@@ -684,6 +992,35 @@ def thread(target: Callable, args: tuple) -> bool:
     return False
 
 
+def update_tier(client: Client, message: Message) -> bool:
+    # Update the global load tier by the pending updates and the message latency
+    try:
+        now = get_now()
+
+        # An edited message keeps its original date
+        lag = now - (message.edit_date or message.date or now)
+        queue = client.dispatcher.updates_queue.qsize()
+        level = max(sum(lag >= t for t in glovar.tier_lag), sum(queue >= q for q in glovar.tier_queue))
+
+        with glovar.locks["tier"]:
+            glovar.tier["lag"] = lag
+            glovar.tier["queue"] = queue
+
+            # Step up at once, step down one tier at a time
+            if level > glovar.tier["level"]:
+                glovar.tier["level"] = level
+                glovar.tier["changed"] = now
+            elif level < glovar.tier["level"] and now - glovar.tier["changed"] >= glovar.time_tier:
+                glovar.tier["level"] -= 1
+                glovar.tier["changed"] = now
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update tier error: {e}", exc_info=True)
+
+    return False
+
+
 def wait_flood(e: FloodWait) -> bool:
     # Wait flood secs
     try:
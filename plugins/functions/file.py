@@ -97,6 +97,20 @@ def get_downloaded_path(client: Client, file_id: str, file_ref: str) -> str:
     return final_path
 
 
+def get_data(file: str) -> Any:
+    # Get the global variable of a data file
+    result = None
+    try:
+        if file.endswith("_words"):
+            result = glovar.rules.get_words(file[:-6])
+        else:
+            result = eval(f"glovar.{file}")
+    except Exception as e:
+        logger.warning(f"Get data error: {e}", exc_info=True)
+
+    return result
+
+
 def get_new_path(extension: str = "") -> str:
     # Get a new path in tmp directory
     result = ""
@@ -125,6 +139,22 @@ def save(file: str) -> bool:
     return False
 
 
+def save_counts(wait: bool = False) -> bool:
+    # Add the regex hit counts to the rules, then save the changed rule files
+    try:
+        for word_type in glovar.rules.flush_counts():
+            if wait:
+                save_thread(f"{word_type}_words")
+            else:
+                save(f"{word_type}_words")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Save counts error: {e}", exc_info=True)
+
+    return False
+
+
 def save_thread(file: str) -> bool:
     # Save thread
     try:
@@ -132,7 +162,7 @@ def save_thread(file: str) -> bool:
             return True
 
         with open(f"data/.{file}", "wb") as f:
-            dump(eval(f"glovar.{file}"), f)
+            dump(get_data(file), f)
 
         copyfile(f"data/.{file}", f"data/{file}")
 
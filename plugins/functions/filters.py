@@ -17,20 +17,22 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import re
-from copy import deepcopy
 from string import ascii_lowercase
-from typing import Match, Optional, Union
+from random import random
+from time import perf_counter, time
+from typing import Dict, List, Match, Optional, Set, Tuple, Union
 
 from pyrogram import CallbackQuery, Client, Filters, Message, User
 
 from .. import glovar
 from .channel import get_content, get_forward_name, get_full_name
-from .etc import get_filename, get_lang, get_links, get_now, get_text, lang
-from .file import save
+from .etc import get_detection, get_detections, get_filename, get_links, get_now, get_text, get_text_view, get_tier
+from .etc import lang, t2t, thread
 from .group import get_description, get_group_sticker, get_pinned
 from .ids import init_group_id
-from .telegram import get_sticker_title
+from .regex import get_case_keys, get_literals
+from .telegram import get_sticker_title, get_user_bio
+from .worker import pool_run, probe_rules
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -304,8 +306,10 @@ def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
         if not text:
             return ""
 
+        scanned = scan(text, ocr)
+
         for c in ascii_lowercase:
-            if c != matched and is_regex_text(f"ad{c}", text, ocr):
+            if c != matched and f"ad{c}" in scanned and is_regex_text(f"ad{c}", text, ocr):
                 return c
     except Exception as e:
         logger.warning(f"Is ad text error: {e}", exc_info=True)
@@ -393,9 +397,9 @@ def is_class_e_user(user: Union[int, User]) -> bool:
 def is_con_text(text: str, ocr: bool) -> bool:
     # Check if the text is con text
     try:
-        if (is_regex_text("con", text, ocr)
-                or is_regex_text("iml", text, ocr)
-                or is_regex_text("pho", text, ocr)):
+        scanned = scan(text, ocr)
+
+        if any(is_regex_text(word_type, text, ocr) for word_type in ["con", "iml", "pho"] if word_type in scanned):
             return True
     except Exception as e:
         logger.warning(f"Is con text error: {e}", exc_info=True)
@@ -475,16 +479,7 @@ def is_emoji(the_type: str, text: str, message: Message = None) -> bool:
         if message:
             text = get_text(message, False, False)
 
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set if emoji in text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
-
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
-
-        for emoji in emoji_set:
-            emoji_dict[emoji] = text.count(emoji)
+        emoji_dict = get_text_view(text, "emoji") or {}
 
         # Check ad
         if the_type == "ad":
@@ -534,8 +529,9 @@ def is_high_score_user(user: User) -> float:
     return 0.0
 
 
-def is_in_config(gid: int, the_type: str, text: str = None) -> Union[bool, str]:
-    # Check if the lang is in the group's config
+def is_in_config(gid: int, the_type: str, text: str = None,
+                 detections: Dict[str, Dict[str, str]] = None) -> Union[bool, str]:
+    # Check if the lang is in the group's config, use the detections if provided
     result = False
 
     try:
@@ -556,8 +552,13 @@ def is_in_config(gid: int, the_type: str, text: str = None) -> Union[bool, str]:
         if text is None:
             return True
 
-        flood = gid in glovar.flooded_ids
-        the_lang = get_lang(text, flood)
+        if detections and text in detections:
+            detection = detections[text]
+        else:
+            tier = get_tier(gid)
+            detection = get_detection(text, tier, set(config[the_type]["list"]))
+
+        the_lang = detection["lang"]
 
         if the_lang and the_lang in config[the_type]["list"]:
             return the_lang
@@ -641,8 +642,9 @@ def is_new_user(user: User, now: int, gid: int = 0, joined: bool = False) -> boo
 def is_nm_text(text: str) -> bool:
     # Check if the text is nm text
     try:
-        if (is_regex_text("nm", text)
-                or is_regex_text("bio", text)
+        scanned = scan(text, False)
+
+        if (any(is_regex_text(word_type, text) for word_type in ["nm", "bio"] if word_type in scanned)
                 or is_ban_text(text, False)):
             return True
     except Exception as e:
@@ -685,26 +687,37 @@ def is_not_allowed(client: Client, message: Message, text: str = None) -> str:
             # Start detect
 
             # Check name
-
             if is_in_config(gid, "name"):
-
-                # Check the forward from name:
                 forward_name = get_forward_name(message)
+                name = get_full_name(message.from_user)
+
+                if forward_name in glovar.except_ids["long"]:
+                    forward_name = ""
+
+                if name in glovar.except_ids["long"]:
+                    name = ""
+
+                # Detect the names at once
+                detections = get_detections([forward_name, name], get_tier(gid),
+                                            set(glovar.configs[gid]["name"]["list"]))
+
+                # Check the forward from name
+                if forward_name:
+                    the_lang = is_in_config(gid, "name", forward_name, detections)
 
-                if forward_name and forward_name not in glovar.except_ids["long"]:
-                    the_lang = is_in_config(gid, "name", forward_name)
                     if the_lang:
                         return f"name {the_lang}"
 
                 # Check the user's name
-                name = get_full_name(message.from_user)
+                if name:
+                    the_lang = is_in_config(gid, "name", name, detections)
 
-                if name and name not in glovar.except_ids["long"]:
-                    the_lang = is_in_config(gid, "name", name)
                     if the_lang:
                         return f"name {the_lang}"
 
             # Check text
+            if not any(is_in_config(gid, the_type) for the_type in ["text", "spc", "spe", "sticker"]):
+                return ""
 
             # Bypass
             message_content = get_content(message)
@@ -727,36 +740,42 @@ def is_not_allowed(client: Client, message: Message, text: str = None) -> str:
 
             # Languages
             if is_in_config(gid, "text"):
+                file_name = get_filename(message)
+                game_title = message.game.title if message.game else ""
+                via_name = get_full_name(message.via_bot) if message.via_bot else ""
+
+                if via_name in glovar.except_ids["long"]:
+                    via_name = ""
+
+                # Detect the texts at once
+                detections = get_detections([message_text, file_name, game_title, via_name], get_tier(gid),
+                                            set(glovar.configs[gid]["text"]["list"]))
+
                 # Plain text
-                the_lang = is_in_config(gid, "text", message_text)
+                the_lang = is_in_config(gid, "text", message_text, detections)
 
                 if the_lang:
                     return f"text {the_lang}"
 
                 # Filename
-                file_name = get_filename(message)
-                the_lang = is_in_config(gid, "text", file_name)
+                the_lang = is_in_config(gid, "text", file_name, detections)
 
                 if the_lang:
                     return f"text {the_lang}"
 
                 # Game
-                if message.game:
-                    game_title = message.game.title
-                    the_lang = is_in_config(gid, "text", game_title)
+                if game_title:
+                    the_lang = is_in_config(gid, "text", game_title, detections)
 
                     if the_lang:
                         return f"text {the_lang}"
 
                 # Via Bot
-                if message.via_bot:
-                    name = get_full_name(message.via_bot)
-
-                    if name not in glovar.except_ids["long"]:
-                        the_lang = is_in_config(gid, "text", name)
+                if via_name:
+                    the_lang = is_in_config(gid, "text", via_name, detections)
 
-                        if the_lang:
-                            return f"text {the_lang} {name}"
+                    if the_lang:
+                        return f"text {the_lang} {via_name}"
 
             # Special Chinese Characters
             if is_in_config(gid, "spc"):
@@ -769,26 +788,20 @@ def is_not_allowed(client: Client, message: Message, text: str = None) -> str:
                     return f"text {lang('spe')}"
 
             # Check Sticker
-            if is_in_config(gid, "sticker"):
+            if is_in_config(gid, "sticker") and message.sticker and message.sticker.set_name:
                 # Bypass
-                group_sticker = get_group_sticker(client, gid)
-
-                if message.sticker:
-                    sticker_name = message.sticker.set_name
+                sticker_name = message.sticker.set_name
 
-                    if sticker_name and sticker_name == group_sticker:
-                        return ""
-                else:
-                    sticker_name = ""
+                if sticker_name == get_group_sticker(client, gid):
+                    return ""
 
-                if sticker_name:
-                    sticker_title = get_sticker_title(client, sticker_name)
+                sticker_title = get_sticker_title(client, sticker_name)
 
-                    if sticker_title not in glovar.except_ids["long"]:
-                        the_lang = is_in_config(gid, "sticker", sticker_title)
+                if sticker_title and sticker_title not in glovar.except_ids["long"]:
+                    the_lang = is_in_config(gid, "sticker", sticker_title)
 
-                        if the_lang:
-                            return f"text {the_lang} {sticker_title}"
+                    if the_lang:
+                        return f"text {the_lang} {sticker_title}"
 
         # Preview message
         else:
@@ -801,45 +814,101 @@ def is_not_allowed(client: Client, message: Message, text: str = None) -> str:
     return ""
 
 
-def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = False) -> Optional[Match]:
+def is_regex_text(word_type: str, text: str, ocr: bool = False) -> Optional[Match]:
     # Check if the text hit the regex rules
     result = None
     try:
-        if text:
-            if not again:
-                text = re.sub(r"\s{2,}", " ", text)
-            elif " " in text:
-                text = re.sub(r"\s", "", text)
-            else:
-                return None
-        else:
+        if not text:
             return None
 
-        with glovar.locks["regex"]:
-            words = list(eval(f"glovar.{word_type}_words"))
+        word = scan(text, ocr).get(word_type)
 
-        for word in words:
-            if ocr and "(?# nocr)" in word:
-                continue
+        if not word:
+            return None
+
+        pattern = glovar.rules.get(word_type)["rules"].get(word)
 
-            result = re.search(word, text, re.I | re.S | re.M)
+        if not pattern:
+            return None
 
-            # Count and return
-            if result:
-                count = eval(f"glovar.{word_type}_words").get(word, 0)
-                count += 1
-                eval(f"glovar.{word_type}_words")[word] = count
-                save(f"{word_type}_words")
-                return result
+        result = pattern.search(get_text_view(text, "collapsed")) or pattern.search(get_text_view(text, "spaceless"))
 
-        # Try again
-        return is_regex_text(word_type, text, ocr, True)
+        # Count in memory, the counts are saved by the timer
+        if result:
+            glovar.rules.add_count(word_type, word)
     except Exception as e:
         logger.warning(f"Is regex text error: {e}", exc_info=True)
 
     return result
 
 
+def is_regex_word(word_type: str, text: str, ocr: bool = False, spaceless: bool = False,
+                  costs: List[Tuple[str, str, float]] = None, literals: Tuple[int, Set[str]] = None) -> str:
+    # Get the regex rule that the text hit, only read the rules so it can run in a worker process
+    result = ""
+    try:
+        if not text:
+            return ""
+
+        compiled = glovar.rules.get(word_type)
+
+        # Without the whitespace, only the rules that may hit differently need to be checked again
+        if spaceless and not compiled["spaceless"]:
+            return ""
+
+        # The rules of one character class hit if the text has any of their characters
+        hits = set()
+
+        if not spaceless and not compiled["chars"].isdisjoint(text):
+            for char in compiled["chars"].intersection(text):
+                hits.update(compiled["classes"][char])
+
+            if ocr:
+                hits -= compiled["nocr"]
+
+        # Only check the rules that may start with a character of the text, in order
+        positions = set(compiled["always"])
+
+        if compiled["index"]:
+            for key in get_case_keys(text) & compiled["index"].keys():
+                positions.update(compiled["index"][key])
+
+        if spaceless:
+            positions &= compiled["spaceless"]
+
+        if ocr:
+            positions -= compiled["nocr"]
+
+        # Only check the rules whose required literal is in the text, if the automaton knows this type's rules
+        if literals and compiled["generation"] <= literals[0]:
+            filtered = set(compiled["unfiltered"])
+
+            for literal in literals[1]:
+                filtered.update(compiled["literals"].get(literal, []))
+
+            positions &= filtered
+
+        for i in sorted(positions | hits):
+            word = compiled["names"][i]
+
+            if i in hits:
+                return word
+
+            if costs is None:
+                hit = compiled["rules"][word].search(text)
+            else:
+                start = perf_counter()
+                hit = compiled["rules"][word].search(text)
+                costs.append((word_type, word, perf_counter() - start))
+
+            if hit:
+                return word
+    except Exception as e:
+        logger.warning(f"Is regex word error: {e}", exc_info=True)
+
+    return result
+
+
 def is_watch_user(user: User, the_type: str, now: int) -> bool:
     # Check if the message is sent by a watch user
     try:
@@ -860,18 +929,176 @@ def is_watch_user(user: User, the_type: str, now: int) -> bool:
 def is_wb_text(text: str, ocr: bool) -> bool:
     # Check if the text is wb text
     try:
-        if (is_regex_text("wb", text, ocr)
-                or is_regex_text("ad", text, ocr)
-                or is_regex_text("iml", text, ocr)
-                or is_regex_text("pho", text, ocr)
-                or is_regex_text("sho", text, ocr)
-                or is_regex_text("spc", text, ocr)):
-            return True
+        scanned = scan(text, ocr)
+        word_types = ["wb", "ad", "iml", "pho", "sho", "spc"] + [f"ad{c}" for c in ascii_lowercase if c not in {"i"}]
 
-        for c in ascii_lowercase:
-            if c not in {"i"} and is_regex_text(f"ad{c}", text, ocr):
-                return True
+        if any(is_regex_text(word_type, text, ocr) for word_type in word_types if word_type in scanned):
+            return True
     except Exception as e:
         logger.warning(f"Is wb text error: {e}", exc_info=True)
 
     return False
+
+
+def prefetch_join(client: Client, message: Message) -> Dict[int, Optional[str]]:
+    # Get the new members' bios and detect the texts before the check takes the lock, the check reads the caches
+    result = {}
+    try:
+        gid = message.chat.id
+        wanted = set()
+
+        for the_type in ["name", "bio"]:
+            if is_in_config(gid, the_type):
+                wanted |= set(glovar.configs[gid][the_type]["list"])
+
+        # Stop at the same members as the check
+        for new in message.new_chat_members:
+            if is_class_d_user(new) or is_declared_message(None, message):
+                break
+
+            name = get_full_name(new)
+
+            if not name or name in glovar.except_ids["long"]:
+                continue
+
+            bio = get_user_bio(client, new.id)
+            result[new.id] = bio
+
+            if bio in glovar.except_ids["long"]:
+                bio = ""
+
+            texts = [name if is_in_config(gid, "name") else "", bio if is_in_config(gid, "bio") else ""]
+            wanted and get_detections(texts, get_tier(gid), wanted)
+
+            if not bio:
+                break
+    except Exception as e:
+        logger.warning(f"Prefetch join error: {e}", exc_info=True)
+
+    return result
+
+
+def prefetch_message(client: Client, message: Message) -> bool:
+    # Detect and scan the message's texts before the check takes the lock, the check reads the caches
+    try:
+        if not message.chat:
+            return True
+
+        gid = message.chat.id
+
+        # The texts checked for NOSPAM
+        if glovar.nospam_id in glovar.admin_ids.get(gid, set()):
+            names = [get_forward_name(message), get_full_name(message.from_user)]
+            names = [t2t(name, True, True) for name in names if name and name not in glovar.except_ids["long"]]
+            texts = names + [get_text(message, True, True), get_filename(message, True, True)]
+
+            for text in texts:
+                scan(text)
+
+        # The names
+        if is_in_config(gid, "name"):
+            names = [get_forward_name(message), get_full_name(message.from_user)]
+            names = [name for name in names if name not in glovar.except_ids["long"]]
+            get_detections(names, get_tier(gid), set(glovar.configs[gid]["name"]["list"]))
+
+        message_text = get_text(message)
+
+        # The texts
+        if is_in_config(gid, "text"):
+            via_name = get_full_name(message.via_bot) if message.via_bot else ""
+            texts = [message_text, get_filename(message), message.game.title if message.game else "",
+                     via_name if via_name not in glovar.except_ids["long"] else ""]
+            get_detections(texts, get_tier(gid), set(glovar.configs[gid]["text"]["list"]))
+
+        # The special characters
+        if is_in_config(gid, "spc") or is_in_config(gid, "spe"):
+            scan(message_text)
+
+        # The sticker's title
+        if is_in_config(gid, "sticker") and message.sticker and message.sticker.set_name:
+            sticker_name = message.sticker.set_name
+            sticker_title = sticker_name != get_group_sticker(client, gid) and get_sticker_title(client, sticker_name)
+
+            if sticker_title and sticker_title not in glovar.except_ids["long"]:
+                is_in_config(gid, "sticker", sticker_title)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Prefetch message error: {e}", exc_info=True)
+
+    return False
+
+
+def scan(text: str, ocr: bool = False) -> Dict[str, str]:
+    # Get the first hit rule of every word type, each text is scanned at most once for the current rules
+    result = {}
+    try:
+        if not text:
+            return {}
+
+        key = (glovar.rules.generation, ocr, text)
+
+        with glovar.locks["scan"]:
+            if key in glovar.regex_scans:
+                glovar.regex_scans.move_to_end(key)
+                return glovar.regex_scans[key]
+
+        # Profile the rules in some of the scans
+        profile = glovar.limit_profile > 0 and random() * glovar.limit_profile < 1
+
+        start = time()
+        scanned = pool_run(scan_words, (text, ocr, profile))
+
+        # Find the slow rules in the background
+        if time() - start > glovar.time_rule:
+            texts = [get_text_view(text, "collapsed"), get_text_view(text, "spaceless")]
+            thread(probe_rules, (texts, ocr))
+
+        # Do not cache a failed scan
+        if scanned is None:
+            return {}
+
+        result, costs = scanned
+
+        if costs:
+            glovar.rules.add_costs(costs)
+
+        if glovar.limit_view <= 0:
+            return result
+
+        with glovar.locks["scan"]:
+            glovar.regex_scans[key] = result
+            glovar.regex_scans.move_to_end(key)
+
+            while len(glovar.regex_scans) > glovar.limit_view:
+                glovar.regex_scans.popitem(last=False)
+    except Exception as e:
+        logger.warning(f"Scan error: {e}", exc_info=True)
+
+    return result
+
+
+def scan_words(text: str, ocr: bool = False,
+               profile: bool = False) -> Tuple[Dict[str, str], List[Tuple[str, str, float]]]:
+    # Check the text with every word type's rules, only read the rules so it can run in a worker process
+    result = {}
+    costs = [] if profile else None
+    try:
+        collapsed = get_text_view(text, "collapsed")
+        spaceless = get_text_view(text, "spaceless")
+
+        # Find the rules' required literals in one pass over each text
+        automaton = glovar.rules.automaton
+        collapsed_literals = (automaton[0], get_literals(automaton, collapsed.lower()))
+        spaceless_literals = (automaton[0], get_literals(automaton, spaceless.lower()))
+
+        for word_type in glovar.regex:
+            word = (is_regex_word(word_type, collapsed, ocr, False, costs, collapsed_literals)
+                    or is_regex_word(word_type, spaceless, ocr, True, costs, spaceless_literals))
+
+            if word:
+                result[word_type] = word
+    except Exception as e:
+        logger.warning(f"Scan words error: {e}", exc_info=True)
+
+    return result, costs or []
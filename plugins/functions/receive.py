@@ -26,8 +26,8 @@ from pyrogram import Client, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from .. import glovar
 from .channel import get_content, get_debug_text, share_data
-from .etc import code, crypt_str, general_link, get_int, get_now, get_report_record, get_stripped_link, get_text, lang
-from .etc import mention_id, thread
+from .etc import code, crypt_str, general_link, get_int, get_now, get_report_record, get_scanned_texts
+from .etc import get_stripped_link, get_text, lang, mention_id, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
 from .filters import is_class_e, is_declared_message_id, is_detected_user_id, is_not_allowed
 from .group import get_config_text, leave_group
@@ -35,6 +35,7 @@ from .ids import init_group_id, init_user_id
 from .telegram import get_messages, send_message, send_report_message
 from .timers import update_admins
 from .user import terminate_user
+from .worker import get_slow_rules, pool_restart
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -545,36 +546,19 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
         if words_data is None:
             return True
 
-        pop_set = set(eval(f"glovar.{file_name}")) - set(words_data)
-        new_set = set(words_data) - set(eval(f"glovar.{file_name}"))
-
-        for word in pop_set:
-            eval(f"glovar.{file_name}").pop(word, 0)
-
-        for word in new_set:
-            eval(f"glovar.{file_name}")[word] = 0
+        # Keep the hit counts and the order of the remaining rules
+        words = glovar.rules.get_words(word_type)
+        words_set = set(words_data)
+        new_words = {word: count for word, count in words.items() if word in words_set}
+        new_words.update({word: 0 for word in words_data if word not in new_words})
 
+        # A rule that is too slow would block the checks, find it in child processes before using the rules
+        slow = get_slow_rules(get_scanned_texts(), [(word_type, word) for word in new_words])
+        glovar.rules.update(word_type, new_words, slow)
         save(file_name)
 
-        # Regenerate special characters dictionary if possible
-        if file_name in {"spc_words", "spe_words"}:
-            special = file_name.split("_")[0]
-            exec(f"glovar.{special}_dict = {{}}")
-
-            for rule in words_data:
-                # Check keys
-                if "[" not in rule:
-                    continue
-
-                # Check value
-                if "?#" not in rule:
-                    continue
-
-                keys = rule.split("]")[0][1:]
-                value = rule.split("?#")[1][1]
-
-                for k in keys:
-                    eval(f"glovar.{special}_dict")[k] = value
+        # Let the worker processes load the new rules
+        pool_restart()
 
         return True
     except Exception as e:
@@ -721,7 +705,14 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
-        exec(f"glovar.{the_type} = the_data")
+        if the_type.endswith("_words"):
+            word_type = the_type[:-6]
+            slow = get_slow_rules(get_scanned_texts(), [(word_type, word) for word in the_data])
+            glovar.rules.update(word_type, the_data, slow)
+            pool_restart()
+        else:
+            exec(f"glovar.{the_type} = the_data")
+
         save(the_type)
 
         # Send debug message
@@ -0,0 +1,785 @@
+# SCP-079-LANG - Ban or delete by detecting the language
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LANG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+from collections import Counter, deque
+from functools import lru_cache
+from sys import maxunicode
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Pattern, Set, Tuple, Union
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# The characters that case-insensitive matching treats as equal to another lowercase character
+try:
+    from re._casefix import _EXTRA_CASES
+    case_fixes = {chr(c): {chr(f) for f in fixes} for c, fixes in _EXTRA_CASES.items()}
+except ImportError:
+    from sre_compile import _equivalences
+    case_fixes = {chr(c): {chr(f) for f in group if f != c} for group in _equivalences for c in group}
+
+# The lowercase code point that case-insensitive matching compares a code point by
+try:
+    from _sre import unicode_tolower
+except ImportError:
+    from _sre import getlower
+    unicode_tolower = lambda c: getlower(c, re.I | re.U)
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class RuleRegistry:
+    # Own each word type's rules, compiled forms, hit counts and special characters dictionaries
+
+    def __init__(self, word_types: Iterable[str]) -> None:
+        self.lock: Lock = Lock()
+        self.costs: Dict[str, Dict[str, Dict[str, Union[float, int]]]] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.generation: int = 0
+        self.automaton: Tuple[int, List[Dict[str, int]], List[int], List[Set[str]]] = (0, *get_automaton([]))
+        self.translation: Dict[int, str] = {}
+        self.quarantined: Dict[str, Dict[str, float]] = {}
+        self.reports: List[Tuple[str, str, float]] = []
+        self.types: Dict[str, Dict[str, Union[Dict[str, int], Dict[str, Pattern], Dict[str, str],
+                                              Dict[str, List[int]], List[int], List[str], Set[int]]]] = {}
+
+        for word_type in word_types:
+            self.types[word_type] = get_compiled(word_type, {})
+
+    def add_costs(self, costs: List[Tuple[str, str, float]]) -> bool:
+        # Add the time used by the rules in a profiled scan
+        try:
+            with self.lock:
+                for word_type, word, elapsed in costs:
+                    cost = self.costs.setdefault(word_type, {}).setdefault(word, {"time": 0.0, "calls": 0, "max": 0.0})
+                    cost["time"] += elapsed
+                    cost["calls"] += 1
+                    cost["max"] = max(cost["max"], elapsed)
+
+            return True
+        except Exception as e:
+            logger.warning(f"Add costs error: {e}", exc_info=True)
+
+        return False
+
+    def add_count(self, word_type: str, word: str) -> bool:
+        # Count a hit in memory
+        try:
+            with self.lock:
+                counts = self.counts.setdefault(word_type, {})
+                counts[word] = counts.get(word, 0) + 1
+
+            return True
+        except Exception as e:
+            logger.warning(f"Add count error: {e}", exc_info=True)
+
+        return False
+
+    def export(self) -> Dict[str, Any]:
+        # Get a copy of the compiled rules without the patterns, to be restored in another process
+        result = {}
+
+        try:
+            with self.lock:
+                types = {}
+
+                # The patterns are compiled again when unpickled, so leave them to the other process
+                for word_type, compiled in self.types.items():
+                    types[word_type] = {**compiled, "rules": {}, "words": dict(compiled["words"])}
+
+                result = {
+                    "automaton": self.automaton,
+                    "generation": self.generation,
+                    "quarantined": {word_type: dict(self.quarantined[word_type]) for word_type in self.quarantined},
+                    "translation": self.translation,
+                    "types": types
+                }
+        except Exception as e:
+            logger.warning(f"Export error: {e}", exc_info=True)
+
+        return result
+
+    def flush_counts(self) -> List[str]:
+        # Add the hit counts to the rules, return the changed word types
+        result = []
+
+        try:
+            with self.lock:
+                counts = self.counts
+                self.counts = {}
+
+                for word_type in counts:
+                    words = self.types[word_type]["words"]
+
+                    for word, count in counts[word_type].items():
+                        # The rule may be removed by an update
+                        if word not in words:
+                            continue
+
+                        words[word] = words[word] + count
+
+                    result.append(word_type)
+        except Exception as e:
+            logger.warning(f"Flush counts error: {e}", exc_info=True)
+
+        return result
+
+    def get(self, word_type: str) -> Dict[str, Union[Dict[str, int], Dict[str, Pattern], Dict[str, str],
+                                                     Dict[str, List[int]], List[int], List[str], Set[int]]]:
+        # Get a word type's compiled rules, the returned dict is never changed by an update
+        return self.types[word_type]
+
+    def get_words(self, word_type: str) -> Dict[str, int]:
+        # Get the rules and their hit counts of a word type
+        return self.types[word_type]["words"]
+
+    def pop_costs(self, word_type: str) -> Dict[str, Dict[str, Union[float, int]]]:
+        # Get and clear the profiled costs of a word type
+        result = {}
+
+        try:
+            with self.lock:
+                result = self.costs.pop(word_type, {})
+        except Exception as e:
+            logger.warning(f"Pop costs error: {e}", exc_info=True)
+
+        return result
+
+    def pop_reports(self) -> List[Tuple[str, str, float]]:
+        # Get and clear the quarantine reports
+        result = []
+
+        try:
+            with self.lock:
+                result = self.reports
+                self.reports = []
+        except Exception as e:
+            logger.warning(f"Pop reports error: {e}", exc_info=True)
+
+        return result
+
+    def quarantine(self, word_type: str, word: str, elapsed: float) -> bool:
+        # Stop using a rule that is too slow, until it is removed by an update
+        try:
+            with self.lock:
+                quarantined = self.quarantined.setdefault(word_type, {})
+
+                if word in quarantined:
+                    return True
+
+                quarantined[word] = elapsed
+                self.reports.append((word_type, word, elapsed))
+                words = self.types[word_type]["words"]
+
+            return self.update(word_type, words)
+        except Exception as e:
+            logger.warning(f"Quarantine error: {e}", exc_info=True)
+
+        return False
+
+    def reset_counts(self, word_type: str) -> bool:
+        # Reset the saved hit counts of a word type
+        try:
+            with self.lock:
+                words = self.types[word_type]["words"]
+
+                for word in words:
+                    words[word] = 0
+
+            return True
+        except Exception as e:
+            logger.warning(f"Reset counts error: {e}", exc_info=True)
+
+        return False
+
+    def restore(self, state: Dict[str, Any]) -> bool:
+        # Use the compiled rules exported by another process, only compile the patterns this process does not have
+        try:
+            types = {}
+
+            for word_type, compiled in state["types"].items():
+                patterns = self.types[word_type]["rules"] if word_type in self.types else {}
+                rules = {rule: patterns.get(rule) or re.compile(rule, re.I | re.M | re.S) for rule in compiled["names"]}
+                types[word_type] = {**compiled, "rules": rules}
+
+            with self.lock:
+                self.automaton = state["automaton"]
+                self.generation = state["generation"]
+                self.quarantined = state["quarantined"]
+                self.translation = state["translation"]
+                self.types = types
+
+            return True
+        except Exception as e:
+            logger.warning(f"Restore error: {e}", exc_info=True)
+
+        return False
+
+    def update(self, word_type: str, words: Dict[str, int], slow: List[Tuple[str, str, float]] = None) -> bool:
+        # Compile the new rules, then replace the old ones at once, the slow rules are quarantined before being used
+        try:
+            with self.lock:
+                quarantined = self.quarantined.get(word_type, {})
+                quarantined = {word: quarantined[word] for word in quarantined if word in words}
+                self.quarantined[word_type] = quarantined
+
+                for _, word, elapsed in slow or []:
+                    if word not in words or word in quarantined:
+                        continue
+
+                    quarantined[word] = elapsed
+                    self.reports.append((word_type, word, elapsed))
+
+            compiled = get_compiled(word_type, words, set(quarantined))
+
+            with self.lock:
+                self.generation += 1
+                compiled["generation"] = self.generation
+                self.types[word_type] = compiled
+
+                # The types newer than the automaton are not prefiltered by it
+                literals = {literal for word_type in self.types for literal in self.types[word_type]["literals"]}
+                self.automaton = (self.generation, *get_automaton(literals))
+
+                # Replace the special Chinese characters, then the special English characters, in one translation
+                if word_type in {"spc", "spe"}:
+                    spc = self.types["spc"]["special"] if "spc" in self.types else {}
+                    spe = self.types["spe"]["special"] if "spe" in self.types else {}
+                    keys = set(spc) | set(spe)
+                    self.translation = str.maketrans({k: spe.get(spc.get(k, k), spc.get(k, k)) for k in keys})
+
+            return True
+        except Exception as e:
+            logger.warning(f"Update error: {e}", exc_info=True)
+
+        return False
+
+
+def get_automaton(literals: Iterable[str]) -> Tuple[List[Dict[str, int]], List[int], List[Set[str]]]:
+    # Build an Aho-Corasick automaton of the literals
+    goto = [{}]
+    fail = [0]
+    out = [set()]
+
+    try:
+        for literal in literals:
+            state = 0
+
+            for char in literal:
+                if char not in goto[state]:
+                    goto.append({})
+                    fail.append(0)
+                    out.append(set())
+                    goto[state][char] = len(goto) - 1
+
+                state = goto[state][char]
+
+            out[state].add(literal)
+
+        # Breadth-first, a state's fail state is its longest proper suffix in the automaton
+        queue = deque(goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, child in goto[state].items():
+                queue.append(child)
+                suffix = fail[state]
+
+                while suffix and char not in goto[suffix]:
+                    suffix = fail[suffix]
+
+                fail[child] = goto[suffix].get(char, 0)
+                out[child] |= out[fail[child]]
+    except Exception as e:
+        logger.warning(f"Get automaton error: {e}", exc_info=True)
+
+    return goto, fail, out
+
+
+def get_case_keys(text: str) -> Set[str]:
+    # Get the characters of the text that case-insensitive matching compares, as lowercase
+    result = set()
+
+    try:
+        result = set(text.lower()) | set(text.upper().lower())
+    except Exception as e:
+        logger.warning(f"Get case keys error: {e}", exc_info=True)
+
+    return result
+
+
+@lru_cache(maxsize=1)
+def get_case_folds() -> Dict[str, Set[str]]:
+    # Get the characters grouped by the lowercase character that case-insensitive matching compares, only built once
+    result = {}
+
+    try:
+        for c in range(maxunicode + 1):
+            fold = unicode_tolower(c)
+
+            if fold != c:
+                result.setdefault(chr(fold), {chr(fold)}).add(chr(c))
+    except Exception as e:
+        logger.warning(f"Get case folds error: {e}", exc_info=True)
+
+    return result
+
+
+def get_chars(rule: str, pattern: Pattern) -> Optional[Set[str]]:
+    # Get the characters that the rule matches, None if the rule is not one character of a class
+    result = None
+
+    try:
+        items = list(sre_parse.parse(rule, re.I | re.M | re.S))
+
+        while len(items) == 1 and items[0][0] is sre_parse.SUBPATTERN:
+            items = list(items[0][1][-1])
+
+        if len(items) != 1:
+            return None
+
+        op, av = items[0]
+
+        if op is sre_parse.LITERAL:
+            chars = {chr(av)}
+        elif op is sre_parse.IN:
+            chars = set()
+
+            for in_op, in_av in av:
+                if in_op is sre_parse.LITERAL:
+                    chars.add(chr(in_av))
+                elif in_op is sre_parse.RANGE and in_av[1] - in_av[0] < 4096:
+                    chars |= {chr(c) for c in range(in_av[0], in_av[1] + 1)}
+                else:
+                    return None
+        else:
+            return None
+
+        # Case-insensitive matching may also hit the other cases, keep the ones the rule really matches
+        folds = get_case_folds()
+        candidates = set()
+
+        for char in chars:
+            keys = {chr(unicode_tolower(ord(c))) for c in {char, char.upper(), char.title()} if len(c) == 1}
+            keys |= {f for key in keys for f in case_fixes.get(key, ())}
+            candidates |= {c for key in keys for c in folds.get(key, {key})}
+
+        result = {c for c in candidates if len(c) == 1 and pattern.fullmatch(c)}
+    except Exception as e:
+        logger.warning(f"Get chars error: {e}", exc_info=True)
+
+    return result
+
+
+def get_compiled(word_type: str, words: Dict[str, int],
+                 quarantined: Set[str] = None) -> Dict[str, Union[Dict[str, int], Dict[str, Pattern], Dict[str, str],
+                                                                  Dict[str, List[int]], List[int], List[str],
+                                                                  Set[int], FrozenSet[str]]]:
+    # Compile the rules and index them by first characters
+    rules = {}
+    names = []
+    index = {}
+    always = []
+    spaceless = set()
+    literals = {}
+    unfiltered = set()
+    nocr = set()
+    classes = {}
+
+    for rule in list(words):
+        if quarantined and rule in quarantined:
+            continue
+
+        try:
+            rules[rule] = re.compile(rule, re.I | re.M | re.S)
+        except Exception as e:
+            logger.warning(f"Compile {word_type} rule error: {e}")
+            continue
+
+        i = len(names)
+        names.append(rule)
+
+        if is_spaceless_needed(rule):
+            spaceless.add(i)
+
+        # Rules not for the text recognized from images
+        if "(?# nocr)" in rule:
+            nocr.add(i)
+
+        # Rules of one character class are looked up by the characters instead of being searched
+        members = get_chars(rule, rules[rule])
+
+        if members is not None:
+            for member in members:
+                classes.setdefault(member, []).append(i)
+
+            continue
+
+        literal = get_literal(rule)
+
+        if literal:
+            literals.setdefault(literal, []).append(i)
+        else:
+            unfiltered.add(i)
+
+        chars = get_first_chars(rule)
+
+        if chars is None:
+            always.append(i)
+            continue
+
+        for char in chars:
+            index.setdefault(char, []).append(i)
+
+    result = {
+        "words": words,
+        "rules": rules,
+        "names": names,
+        "index": index,
+        "always": always,
+        "spaceless": spaceless,
+        "literals": literals,
+        "unfiltered": unfiltered,
+        "nocr": nocr,
+        "chars": frozenset(classes),
+        "classes": classes,
+        "generation": 0,
+        "special": get_special(words) if word_type in {"spc", "spe"} else {}
+    }
+
+    return result
+
+
+def get_first_chars(rule: str) -> Optional[Set[str]]:
+    # Get the case keys of the characters that the rule's matches may start with, None if it may start with any
+    result = None
+
+    try:
+        chars, nullable = get_first_chars_seq(list(sre_parse.parse(rule, re.I | re.M | re.S)))
+
+        # A rule that can match the empty string matches every text
+        if chars is None or nullable:
+            return None
+
+        result = set()
+
+        for char in chars:
+            result |= get_case_keys(char)
+    except Exception as e:
+        logger.warning(f"Get first chars error: {e}", exc_info=True)
+
+    return result
+
+
+def get_first_chars_item(op: Any, av: Any) -> Tuple[Optional[Set[str]], bool]:
+    # Get the first characters of a parsed item, and whether it can match the empty string
+    try:
+        if op is sre_parse.LITERAL:
+            return {chr(av)}, False
+
+        if op is sre_parse.IN:
+            chars = set()
+
+            for in_op, in_av in av:
+                if in_op is sre_parse.LITERAL:
+                    chars.add(chr(in_av))
+                elif in_op is sre_parse.RANGE and in_av[1] - in_av[0] < 256:
+                    chars |= {chr(c) for c in range(in_av[0], in_av[1] + 1)}
+                else:
+                    return None, False
+
+            return chars, False
+
+        # Zero-width items
+        if op in {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT}:
+            return set(), True
+
+        if op is sre_parse.SUBPATTERN:
+            return get_first_chars_seq(list(av[-1]))
+
+        if op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            return get_first_chars_seq(list(av))
+
+        if op is sre_parse.BRANCH:
+            chars = set()
+            nullable = False
+
+            for seq in av[1]:
+                seq_chars, seq_nullable = get_first_chars_seq(list(seq))
+
+                if seq_chars is None:
+                    return None, False
+
+                chars |= seq_chars
+                nullable = nullable or seq_nullable
+
+            return chars, nullable
+
+        if op in {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)}:
+            chars, nullable = get_first_chars_seq(list(av[2]))
+            return chars, nullable or av[0] == 0
+    except Exception as e:
+        logger.warning(f"Get first chars item error: {e}", exc_info=True)
+
+    return None, False
+
+
+def get_first_chars_seq(seq: list) -> Tuple[Optional[Set[str]], bool]:
+    # Get the first characters of a parsed sequence, and whether it can match the empty string
+    chars = set()
+
+    try:
+        for op, av in seq:
+            item_chars, nullable = get_first_chars_item(op, av)
+
+            if item_chars is None:
+                return None, False
+
+            chars |= item_chars
+
+            if not nullable:
+                return chars, False
+    except Exception as e:
+        logger.warning(f"Get first chars seq error: {e}", exc_info=True)
+        return None, False
+
+    return chars, True
+
+
+def get_literal(rule: str) -> str:
+    # Get the longest literal that every match of the rule contains, in lowercase
+    result = ""
+
+    try:
+        literals = get_literals_seq(list(sre_parse.parse(rule, re.I | re.M | re.S)))
+        result = max(literals, key=len, default="")
+
+        # A single character is not selective enough
+        if len(result) < 2:
+            return ""
+    except Exception as e:
+        logger.warning(f"Get literal error: {e}", exc_info=True)
+
+    return result
+
+
+def get_literals(automaton: Tuple[int, List[Dict[str, int]], List[int], List[Set[str]]], text: str) -> Set[str]:
+    # Get the automaton's literals that the lowercase text contains, in one pass
+    result = set()
+
+    try:
+        _, goto, fail, out = automaton
+        state = 0
+
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+
+            if out[state]:
+                result |= out[state]
+    except Exception as e:
+        logger.warning(f"Get literals error: {e}", exc_info=True)
+
+    return result
+
+
+def get_literals_seq(seq: list) -> List[str]:
+    # Get the literals that every match of a parsed sequence contains
+    result = []
+
+    try:
+        literal = ""
+
+        for op, av in seq:
+            # Only use the characters that match the same lowercase character in any case
+            if op is sre_parse.LITERAL:
+                char = chr(av).lower()
+
+                if len(char) == 1 and char not in case_fixes:
+                    literal += char
+                    continue
+
+            if literal:
+                result.append(literal)
+                literal = ""
+
+            if op is sre_parse.SUBPATTERN:
+                result += get_literals_seq(list(av[-1]))
+            elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+                result += get_literals_seq(list(av))
+            elif op is sre_parse.ASSERT and av[0] == 1:
+                result += get_literals_seq(list(av[1]))
+            elif (op in {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)}
+                  and av[0] >= 1):
+                result += get_literals_seq(list(av[2]))
+
+        if literal:
+            result.append(literal)
+    except Exception as e:
+        logger.warning(f"Get literals seq error: {e}", exc_info=True)
+        return []
+
+    return result
+
+
+def get_ops(item: Any) -> Set[Any]:
+    # Get all the operators in a parsed rule
+    result = set()
+
+    try:
+        if isinstance(item, sre_parse.SubPattern):
+            for op, av in item:
+                result.add(op)
+                result |= get_ops(av)
+        elif isinstance(item, (list, tuple)):
+            for i in item:
+                result |= get_ops(i)
+    except Exception as e:
+        logger.warning(f"Get ops error: {e}", exc_info=True)
+
+    return result
+
+
+def get_special(words: Iterable[str]) -> Dict[str, str]:
+    # Get the special characters dictionary from the rules like "[ab](?# c)"
+    result = {}
+
+    try:
+        for rule in words:
+            # Check keys
+            if "[" not in rule:
+                continue
+
+            # Check value
+            if "?#" not in rule:
+                continue
+
+            keys = rule.split("]")[0][1:]
+            value = rule.split("?#")[1][1]
+
+            for k in keys:
+                result[k] = value
+    except Exception as e:
+        logger.warning(f"Get special error: {e}", exc_info=True)
+
+    return result
+
+
+def get_tokenizer(words: Iterable[str]) -> Tuple[Pattern, Dict[str, dict]]:
+    # Get a tokenizer of the words, a pattern of their first characters and a trie
+    result = (re.compile("(?!)"), {})
+
+    try:
+        first = set()
+        trie = {}
+
+        for word in words:
+            if not word:
+                continue
+
+            first.add(ord(word[0]))
+            node = trie
+
+            for char in word:
+                node = node.setdefault(char, {})
+
+            node[""] = {}
+
+        if not trie:
+            return result
+
+        # Character ranges keep the class fast for the characters outside the BMP
+        ranges = []
+
+        for c in sorted(first):
+            if ranges and ranges[-1][1] == c - 1:
+                ranges[-1][1] = c
+            else:
+                ranges.append([c, c])
+
+        pattern = "".join(re.escape(chr(a)) if a == b else f"{re.escape(chr(a))}-{re.escape(chr(b))}"
+                          for a, b in ranges)
+        result = (re.compile(f"[{pattern}]"), trie)
+    except Exception as e:
+        logger.warning(f"Get tokenizer error: {e}", exc_info=True)
+
+    return result
+
+
+def get_tokens(tokenizer: Tuple[Pattern, Dict[str, dict]], text: str) -> Counter:
+    # Count the words in the text in one pass, the longest word wins at each position
+    result = Counter()
+
+    try:
+        first, trie = tokenizer
+        position = 0
+
+        while True:
+            match = first.search(text, position)
+
+            if not match:
+                break
+
+            start = match.start()
+            end = 0
+            node = trie
+            i = start
+
+            while i < len(text) and text[i] in node:
+                node = node[text[i]]
+                i += 1
+
+                if "" in node:
+                    end = i
+
+            if end:
+                result[text[start:end]] += 1
+                position = end
+            else:
+                position = start + 1
+    except Exception as e:
+        logger.warning(f"Get tokens error: {e}", exc_info=True)
+
+    return result
+
+
+def is_spaceless_needed(rule: str) -> bool:
+    # Check if the rule may hit a text only after the whitespace is removed
+    result = True
+
+    try:
+        parsed = sre_parse.parse(rule, re.I | re.M | re.S)
+
+        if parsed.getwidth()[1] > 1:
+            return True
+
+        # A single character rule hits the same characters, unless it depends on the context
+        result = bool(get_ops(parsed) & {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT, sre_parse.GROUPREF,
+                                         getattr(sre_parse, "GROUPREF_EXISTS", None)})
+    except Exception as e:
+        logger.warning(f"Is spaceless needed error: {e}", exc_info=True)
+
+    return result
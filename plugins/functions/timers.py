@@ -24,8 +24,8 @@ from pyrogram import Client
 
 from .. import glovar
 from .channel import ask_for_help, get_debug_text, share_data, share_regex_count
-from .etc import code, general_link, get_full_name, get_now, lang, message_link, thread
-from .file import save
+from .etc import code, general_link, get_detection, get_full_name, get_now, lang, message_link, thread
+from .file import get_data, save, save_counts
 from .filters import is_in_config
 from .group import leave_group
 from .telegram import get_admins, get_group_info, send_message
@@ -40,7 +40,7 @@ def backup_files(client: Client) -> bool:
     try:
         for file in glovar.file_list:
             # Check
-            if not eval(f"glovar.{file}"):
+            if not get_data(file):
                 continue
 
             # Share
@@ -61,6 +61,52 @@ def backup_files(client: Client) -> bool:
     return False
 
 
+def interval_min_1(client: Client) -> bool:
+    # Execute every minute
+    try:
+        # Save the regex hit counts
+        save_counts()
+
+        # Report the quarantined rules
+        for word_type, word, elapsed in glovar.rules.pop_reports():
+            text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                    f"{lang('issue')}{lang('colon')}{code(lang('regex_quarantine'))}\n"
+                    f"{lang('regex_type')}{lang('colon')}{code(f'{word_type}_words')}\n"
+                    f"{lang('rule')}{lang('colon')}{code(word)}\n"
+                    f"{lang('regex_time')}{lang('colon')}{code(f'{elapsed:.3f}s')}\n")
+            thread(send_message, (client, glovar.debug_channel_id, text))
+
+        # Report the load tier change
+        with glovar.locks["tier"]:
+            level = glovar.tier["level"]
+            reported = glovar.tier["reported"]
+            lag = glovar.tier["lag"]
+            queue = glovar.tier["queue"]
+            glovar.tier["reported"] = level
+
+        if level == reported:
+            return True
+
+        with glovar.locks["lang"]:
+            hit = glovar.lang_cache_count["hit"]
+            total = hit + glovar.lang_cache_count["miss"]
+
+        text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                f"{lang('issue')}{lang('colon')}{code(lang('tier_change'))}\n"
+                f"{lang('load_tier')}{lang('colon')}{code(f'{reported} → {level}')}\n"
+                f"{lang('description')}{lang('colon')}{code(lang(f'tier_{level}'))}\n"
+                f"{lang('load_queue')}{lang('colon')}{code(queue)}\n"
+                f"{lang('load_lag')}{lang('colon')}{code(lag)}\n"
+                f"{lang('load_cache')}{lang('colon')}{code(f'{hit} / {total}')}\n")
+        thread(send_message, (client, glovar.debug_channel_id, text))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Interval min 1 error: {e}", exc_info=True)
+
+    return False
+
+
 def interval_min_10() -> bool:
     # Execute every 10 minutes
     glovar.locks["message"].acquire()
@@ -108,11 +154,22 @@ def interval_min_15(client: Client) -> bool:
             if not name or name in glovar.except_ids["long"]:
                 continue
 
-            # Check name
+            # Detect the name once for all groups
             g_list = list(user_ids[uid]["join"])
+            wanted = set()
+
+            for gid in g_list:
+                if is_in_config(gid, "name"):
+                    wanted |= set(glovar.configs[gid]["name"]["list"])
+
+            if not wanted:
+                continue
 
+            detections = {name: get_detection(name, 0, wanted)}
+
+            # Check name
             for gid in g_list:
-                the_lang = is_in_config(gid, "name", name)
+                the_lang = is_in_config(gid, "name", name, detections)
 
                 if not the_lang:
                     continue
@@ -180,13 +237,11 @@ def send_count(client: Client) -> bool:
     # Send regex count to REGEX
     glovar.locks["regex"].acquire()
     try:
+        save_counts(True)
+
         for word_type in glovar.regex:
             share_regex_count(client, word_type)
-            word_list = list(eval(f"glovar.{word_type}_words"))
-
-            for word in word_list:
-                eval(f"glovar.{word_type}_words")[word] = 0
-
+            glovar.rules.reset_counts(word_type)
             save(f"{word_type}_words")
 
         return True
@@ -0,0 +1,338 @@
+# SCP-079-LANG - Ban or delete by detecting the language
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LANG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+from multiprocessing import TimeoutError, get_context
+from multiprocessing.connection import Connection
+from multiprocessing.context import BaseContext
+from multiprocessing.pool import Pool
+from os import getpid
+from signal import SIGINT, SIG_IGN, signal
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .. import glovar
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def get_process_context() -> BaseContext:
+    # Get the context of the child processes, they are forked from a server process that has no other threads
+    result = get_context("forkserver")
+
+    try:
+        # The server imports the modules once, without running the main script again
+        result.set_forkserver_preload([glovar.__name__, f"{__package__}.filters"])
+    except Exception as e:
+        logger.warning(f"Get process context error: {e}", exc_info=True)
+
+    return result
+
+
+def get_slow_rules(texts: List[str], items: List[Tuple[str, str]]) -> List[Tuple[str, str, float]]:
+    # Time the rules for the texts in child processes, get the rules that are too slow and their time used
+    result = []
+
+    try:
+        if not texts:
+            return []
+
+        i = 0
+
+        while i < len(items):
+            context = get_process_context()
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=probe_child, args=(child_conn, texts, items[i:]))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+
+            try:
+                # Wait for the child process to be ready
+                if not parent_conn.poll(glovar.time_task):
+                    break
+
+                parent_conn.recv()
+
+                while i < len(items):
+                    # The rule is still running after the task's time limit
+                    if not parent_conn.poll(glovar.time_task):
+                        result.append((*items[i], float(glovar.time_task)))
+                        i += 1
+                        break
+
+                    elapsed = parent_conn.recv()
+
+                    if elapsed > glovar.time_rule:
+                        result.append((*items[i], elapsed))
+
+                    i += 1
+            except EOFError:
+                # The child process died on the rule, go on with the next one
+                logger.warning(f"Get slow rules child exited: {items[i]}")
+                i += 1
+            finally:
+                parent_conn.close()
+                process.terminate()
+                process.join()
+    except Exception as e:
+        logger.warning(f"Get slow rules error: {e}", exc_info=True)
+
+    return result
+
+
+def pool_close(pool: Optional[Pool], terminate: bool = False) -> bool:
+    # Close a process pool, let the running tasks finish unless terminate
+    try:
+        if not pool:
+            return True
+
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+
+        pool.join()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Pool close error: {e}", exc_info=True)
+
+    return False
+
+
+def pool_init(state: Dict[str, Any]) -> bool:
+    # Load the current rules in a worker process
+    try:
+        signal(SIGINT, SIG_IGN)
+        glovar.rules.restore(state)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Pool init error: {e}", exc_info=True)
+
+    return False
+
+
+def pool_ping() -> int:
+    # Answer the parent process with the worker's process id
+    return getpid()
+
+
+def pool_restart(old: Optional[Pool] = None, terminate: bool = False) -> bool:
+    # Replace the process pool in the background, the workers will see the current data
+    try:
+        if glovar.limit_process <= 0:
+            return True
+
+        with glovar.locks["pool"]:
+            if old and old is not glovar.pool:
+                return True
+
+            # The stuck pool is terminated when it is replaced, by the pending new pool if there is one
+            if terminate:
+                glovar.pool_state["kill"] = True
+
+            if old and glovar.pool_state["ready"] < glovar.pool_state["version"]:
+                return True
+
+            glovar.pool_state["version"] += 1
+            version = glovar.pool_state["version"]
+
+        t = Thread(target=pool_swap, args=(version,))
+        t.daemon = True
+        t.start()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Pool restart error: {e}", exc_info=True)
+
+    return False
+
+
+def pool_run(target: Callable, args: tuple) -> Any:
+    # Run the target in the process pool if enabled, wait for the result within the time limit,
+    # return None if the task failed
+    result = None
+    pool = None
+
+    try:
+        pool = glovar.pool
+
+        if not pool:
+            return target(*args)
+
+        # Block the caller while too many tasks are pending
+        with glovar.pool_semaphore:
+            result = pool.apply_async(target, args).get(glovar.time_task)
+    except TimeoutError:
+        logger.warning(f"Pool run timeout: {target.__name__}")
+        pool_restart(pool, True)
+    except Exception as e:
+        logger.warning(f"Pool run error: {e}", exc_info=True)
+
+    return result
+
+
+def pool_start() -> bool:
+    # Start the fork server and the process pool, before the bot is online
+    try:
+        context = get_process_context()
+
+        # The fork server imports glovar, which clears tmp and loads the data, so start it before the bot is online
+        process = context.Process(target=pool_ping)
+        process.daemon = True
+        process.start()
+        process.join()
+
+        # Without the worker processes, the scans run in the handler threads and time_task is not enforced
+        if glovar.limit_process <= 0:
+            logger.warning("Pool start: limit_process is 0, the scans have no time limit")
+            return True
+
+        return pool_swap(glovar.pool_state["version"])
+    except Exception as e:
+        logger.warning(f"Pool start error: {e}", exc_info=True)
+
+    return False
+
+
+def pool_swap(version: int) -> bool:
+    # Start a new process pool, replace the current one after every worker has loaded the rules
+    pool = None
+
+    try:
+        pool = get_process_context().Pool(glovar.limit_process, pool_init, (glovar.rules.export(),))
+        ready = pool_warm(pool)
+
+        with glovar.locks["pool"]:
+            # A newer restart replaces the current pool instead
+            if version != glovar.pool_state["version"]:
+                return True
+
+            glovar.pool_state["ready"] = version
+
+            if not ready:
+                logger.warning(f"Pool swap: the workers are not ready in {glovar.time_pool} seconds")
+                return False
+
+            old = glovar.pool
+            glovar.pool = pool
+            pool = None
+            terminate = glovar.pool_state["kill"]
+            glovar.pool_state["kill"] = False
+
+        return pool_close(old, terminate)
+    except Exception as e:
+        logger.warning(f"Pool swap error: {e}", exc_info=True)
+    finally:
+        pool_close(pool, True)
+
+    return False
+
+
+def pool_warm(pool: Pool) -> bool:
+    # Wait until every worker of the pool has loaded the rules, only the loaded workers take the pings
+    try:
+        pids = set()
+        deadline = perf_counter() + glovar.time_pool
+
+        while len(pids) < glovar.limit_process:
+            pid = pool.apply_async(pool_ping).get(max(deadline - perf_counter(), 0))
+
+            if pid in pids:
+                sleep(0.1)
+
+            pids.add(pid)
+
+        return True
+    except TimeoutError:
+        return False
+    except Exception as e:
+        logger.warning(f"Pool warm error: {e}", exc_info=True)
+
+    return False
+
+
+def probe_child(conn: Connection, texts: List[str], items: List[Tuple[str, str]]) -> bool:
+    # Time the rules one by one, send the longest time a rule used for a text to the parent process
+    try:
+        signal(SIGINT, SIG_IGN)
+        conn.send(0.0)
+
+        for word_type, word in items:
+            elapsed = 0.0
+
+            try:
+                pattern = re.compile(word, re.I | re.M | re.S)
+            except Exception as e:
+                logger.warning(f"Probe child compile {word_type} rule error: {e}")
+                conn.send(elapsed)
+                continue
+
+            for text in texts:
+                if not text:
+                    continue
+
+                start = perf_counter()
+                pattern.search(text)
+                elapsed = max(elapsed, perf_counter() - start)
+
+            conn.send(elapsed)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Probe child error: {e}", exc_info=True)
+    finally:
+        conn.close()
+
+    return False
+
+
+def probe_rules(texts: List[str], ocr: bool = False) -> bool:
+    # Find the rules that are too slow for the texts, and quarantine them
+    if not glovar.locks["probe"].acquire(blocking=False):
+        return True
+
+    try:
+        items = []
+
+        for word_type in glovar.regex:
+            compiled = glovar.rules.get(word_type)
+            items += [(word_type, word) for i, word in enumerate(compiled["names"])
+                      if not (ocr and i in compiled["nocr"])]
+
+        quarantined = False
+
+        for word_type, word, elapsed in get_slow_rules(texts, items):
+            quarantined = glovar.rules.quarantine(word_type, word, elapsed) or quarantined
+
+        # Let the worker processes drop the quarantined rules
+        if quarantined:
+            pool_restart()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Probe rules error: {e}", exc_info=True)
+    finally:
+        glovar.locks["probe"].release()
+
+    return False
@@ -19,17 +19,24 @@
 import logging
 import pickle
 from codecs import getdecoder
+from collections import OrderedDict
 from configparser import RawConfigParser
+from multiprocessing.pool import Pool
 from os import mkdir
 from os.path import exists
+from queue import Queue
 from shutil import rmtree
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Union
+from threading import BoundedSemaphore, Lock, local
+from typing import Dict, List, Optional, Pattern, Set, Tuple, Union
 
 from emoji import UNICODE_EMOJI
+from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+from opencc import OpenCC
 from pyrogram import Chat
 
+from .functions.regex import RuleRegistry, get_tokenizer
+
 # Enable logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -76,16 +83,29 @@ default_group_link: str = ""
 lang_all: Union[str, Set[str]] = ""
 lang_bio: Union[str, Set[str]] = ""
 lang_name: Union[str, Set[str]] = ""
+lang_prob: float = 0.8
 lang_protect: Union[str, Set[str]] = ""
 lang_sticker: Union[str, Set[str]] = ""
 lang_text: Union[str, Set[str]] = ""
+limit_cache: int = 10000
+limit_process: int = 2
+limit_profile: int = 100
+limit_task: int = 16
 limit_track: int = 0
+limit_view: int = 1000
 project_link: str = ""
 project_name: str = ""
+tier_lag: Union[str, List[int]] = ""
+tier_queue: Union[str, List[int]] = ""
 time_ban: int = 0
+time_cache: int = 3600
 time_new: int = 0
 time_punish: int = 0
+time_pool: int = 60
+time_rule: float = 0.5
 time_short: int = 0
+time_task: int = 3
+time_tier: int = 60
 time_track: int = 0
 zh_cn: Union[bool, str] = ""
 
@@ -144,19 +164,34 @@ try:
     lang_bio = set(lang_bio.split())
     lang_name = config["custom"].get("lang_name", lang_name)
     lang_name = set(lang_name.split())
+    lang_prob = float(config["custom"].get("lang_prob", str(lang_prob)))
     lang_protect = config["custom"].get("lang_protect", lang_protect)
     lang_protect = set(lang_protect.split())
     lang_sticker = config["custom"].get("lang_sticker", lang_sticker)
     lang_sticker = set(lang_sticker.split())
     lang_text = config["custom"].get("lang_text", lang_text)
     lang_text = set(lang_text.split())
+    limit_cache = int(config["custom"].get("limit_cache", str(limit_cache)))
+    limit_process = int(config["custom"].get("limit_process", str(limit_process)))
+    limit_profile = int(config["custom"].get("limit_profile", str(limit_profile)))
+    limit_task = int(config["custom"].get("limit_task", str(limit_task)))
     limit_track = int(config["custom"].get("limit_track", str(limit_track)))
+    limit_view = int(config["custom"].get("limit_view", str(limit_view)))
     project_link = config["custom"].get("project_link", project_link)
     project_name = config["custom"].get("project_name", project_name)
+    tier_lag = config["custom"].get("tier_lag", tier_lag)
+    tier_lag = [int(t) for t in tier_lag.split()]
+    tier_queue = config["custom"].get("tier_queue", tier_queue)
+    tier_queue = [int(t) for t in tier_queue.split()]
     time_ban = int(config["custom"].get("time_ban", str(time_ban)))
+    time_cache = int(config["custom"].get("time_cache", str(time_cache)))
     time_new = int(config["custom"].get("time_new", str(time_new)))
     time_punish = int(config["custom"].get("time_punish", str(time_punish)))
+    time_pool = int(config["custom"].get("time_pool", str(time_pool)))
+    time_rule = float(config["custom"].get("time_rule", str(time_rule)))
     time_short = int(config["custom"].get("time_short", str(time_short)))
+    time_task = int(config["custom"].get("time_task", str(time_task)))
+    time_tier = int(config["custom"].get("time_tier", str(time_tier)))
     time_track = int(config["custom"].get("time_track", str(time_track)))
     zh_cn = config["custom"].get("zh_cn", zh_cn)
     zh_cn = eval(zh_cn)
@@ -204,16 +239,29 @@ if (bot_token in {"", "[DATA EXPUNGED]"}
         or lang_all in {"", "[DATA EXPUNGED]"} or lang_all == set()
         or lang_bio in {"", "[DATA EXPUNGED]"} or lang_bio == set()
         or lang_name in {"", "[DATA EXPUNGED]"} or lang_name == set()
+        or not 0 < lang_prob <= 1
         or lang_protect in {"", "[DATA EXPUNGED]"} or lang_protect == set()
         or lang_sticker in {"", "[DATA EXPUNGED]"} or lang_sticker == set()
         or lang_text in {"", "[DATA EXPUNGED]"} or lang_text == set()
+        or limit_cache < 0
+        or limit_process < 0
+        or limit_profile < 0
+        or limit_task == 0
         or limit_track == 0
+        or limit_view < 0
         or project_link in {"", "[DATA EXPUNGED]"}
         or project_name in {"", "[DATA EXPUNGED]"}
+        or len(tier_lag) != 3
+        or len(tier_queue) != 3
         or time_ban == 0
+        or time_cache == 0
         or time_new == 0
         or time_punish == 0
+        or time_pool <= 0
+        or time_rule <= 0
         or time_short == 0
+        or time_task == 0
+        or time_tier == 0
         or time_track == 0
         or zh_cn not in {False, True}
         or emoji_ad_single == 0
@@ -308,6 +356,16 @@ lang: Dict[str, str] = {
     "refresh": (zh_cn and "刷新群管列表") or "Refresh Admin Lists",
     "status_joined": (zh_cn and "已加入群组") or "Joined the Group",
     "status_left": (zh_cn and "已退出群组") or "Left the Group",
+    # Load
+    "load_cache": (zh_cn and "语言缓存命中") or "Language Cache Hits",
+    "load_lag": (zh_cn and "消息延迟") or "Message Latency",
+    "load_queue": (zh_cn and "待处理更新") or "Pending Updates",
+    "load_tier": (zh_cn and "负载等级") or "Load Tier",
+    "tier_change": (zh_cn and "负载等级变更") or "Load Tier Changed",
+    "tier_0": (zh_cn and "完整检测") or "Full Detection",
+    "tier_1": (zh_cn and "跳过复查") or "No Recheck",
+    "tier_2": (zh_cn and "仅文字系统") or "Script Only",
+    "tier_3": (zh_cn and "仅缓存") or "Cache Only",
     # More
     "privacy": (zh_cn and "可能涉及隐私而未转发") or "Not Forwarded Due to Privacy Reason",
     "cannot_forward": (zh_cn and "此类消息无法转发至频道") or "The Message Cannot be Forwarded to Channel",
@@ -334,6 +392,9 @@ lang: Dict[str, str] = {
     "more": (zh_cn and "附加信息") or "Extra Info",
     # Regex
     "bio": (zh_cn and "简介检查") or "Bio",
+    "regex_quarantine": (zh_cn and "规则耗时过长已隔离") or "Slow Rule Quarantined",
+    "regex_time": (zh_cn and "单次耗时") or "Time Used",
+    "regex_type": (zh_cn and "规则类别") or "Rule Type",
     # Special
     "bio_ban": (zh_cn and "简介封禁") or "Bio Ban",
     "bio_examine": (zh_cn and "简介检查") or "Bio Examination",
@@ -448,15 +509,46 @@ default_user_status: Dict[str, Dict[Union[int, str], Union[float, int]]] = {
 
 emoji_set: Set[str] = set(UNICODE_EMOJI)
 
+emoji_tokenizer: Tuple[Pattern, Dict[str, dict]] = get_tokenizer(emoji_set)
+
+fields: local = local()
+# fields.cache = {
+#     id(message): (message, {"text False False": "text"})
+# }
+
+lang_cache: Dict[str, Tuple[Dict[str, str], float]] = OrderedDict()
+# lang_cache = {
+#     "md5sum 0": ({"lang": "fa"}, 1512345678.0)
+# }
+
+lang_cache_count: Dict[str, int] = {
+    "hit": 0,
+    "miss": 0
+}
+
+lang_cache_sign: Tuple[frozenset, frozenset] = (frozenset(), frozenset())
+
 locks: Dict[str, Lock] = {
     "admin": Lock(),
+    "lang": Lock(),
     "message": Lock(),
+    "opencc": Lock(),
+    "pool": Lock(),
+    "probe": Lock(),
     "receive": Lock(),
     "regex": Lock(),
+    "scan": Lock(),
     "test": Lock(),
-    "text": Lock()
+    "text": Lock(),
+    "tier": Lock(),
+    "view": Lock()
 }
 
+opencc_cache: Dict[str, str] = OrderedDict()
+# opencc_cache = {
+#     "繁體": "繁体"
+# }
+
 other_commands: List[str] = [
     "content",
     "findall",
@@ -470,6 +562,16 @@ other_commands: List[str] = [
     "t2t"
 ]
 
+pool: Optional[Pool] = None
+
+pool_state: Dict[str, Union[bool, int]] = {
+    "kill": False,
+    "ready": 0,
+    "version": 0
+}
+
+pool_semaphore: BoundedSemaphore = BoundedSemaphore(limit_task)
+
 receivers: Dict[str, List[str]] = {
     "bad": ["ANALYZE", "APPLY", "AVATAR", "CAPTCHA", "CLEAN", "LANG", "LONG", "MANAGE",
             "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TICKET", "TIP", "USER", "WARN", "WATCH"],
@@ -506,6 +608,50 @@ regex: Dict[str, bool] = {
 for c in ascii_lowercase:
     regex[f"ad{c}"] = False
 
+regex_scans: Dict[Tuple[int, bool, str], Dict[str, str]] = OrderedDict()
+# regex_scans = {
+#     (0, False, "text"): {"type": "regex"}
+# }
+
+script_chars: Dict[str, str] = {}
+# script_chars = {
+#     "a": "LATIN"
+# }
+
+scripts: Dict[str, Set[str]] = {
+    "ARABIC": {"ar", "fa", "ku", "ps", "ug", "ur"},
+    "ARMENIAN": {"hy"},
+    "BENGALI": {"as", "bn"},
+    "BOPOMOFO": {"zh"},
+    "CJK": {"zh"},
+    "CYRILLIC": {"be", "bg", "kk", "ky", "mk", "mn", "ru", "sr", "tg", "uk"},
+    "DEVANAGARI": {"hi", "mr", "ne", "sa"},
+    "ETHIOPIC": {"am", "ti"},
+    "GEORGIAN": {"ka"},
+    "GREEK": {"el"},
+    "GUJARATI": {"gu"},
+    "GURMUKHI": {"pa"},
+    "HANGUL": {"ko"},
+    "HEBREW": {"he", "yi"},
+    "KANA": {"ja"},
+    "KANNADA": {"kn"},
+    "KHMER": {"km"},
+    "LAO": {"lo"},
+    "LATIN": {"af", "an", "az", "br", "bs", "ca", "cs", "cy", "da", "de", "en", "eo", "es", "et", "eu", "fi",
+              "fo", "fr", "ga", "gl", "hr", "ht", "hu", "id", "is", "it", "jv", "ku", "la", "lb", "lt", "lv",
+              "mg", "ms", "mt", "nb", "nl", "nn", "no", "oc", "pl", "pt", "qu", "ro", "rw", "se", "sk", "sl",
+              "so", "sq", "sr", "sv", "sw", "tl", "tr", "uz", "vi", "vo", "wa", "xh", "zu"},
+    "MALAYALAM": {"ml"},
+    "MONGOLIAN": {"mn"},
+    "MYANMAR": {"my"},
+    "ORIYA": {"or"},
+    "SINHALA": {"si"},
+    "TAMIL": {"ta"},
+    "TELUGU": {"te"},
+    "THAI": {"th"},
+    "TIBETAN": {"bo", "dz"}
+}
+
 sender: str = "LANG"
 
 should_hide: bool = False
@@ -515,6 +661,22 @@ sticker_titles: Dict[str, str] = {}
 #     "short_name": "sticker_title"
 # }
 
+text_views: Dict[str, Dict[str, Union[str, Dict[str, int]]]] = OrderedDict()
+# text_views = {
+#     "raw text": {
+#         "normal 1": "normalized text",
+#         "emoji": {"👍": 2}
+#     }
+# }
+
+tier: Dict[str, int] = {
+    "level": 0,
+    "lag": 0,
+    "queue": 0,
+    "changed": 0,
+    "reported": 0
+}
+
 version: str = "0.2.2"
 
 # Load data from pickle
@@ -639,11 +801,22 @@ configs: Dict[int, Dict[str, Union[bool, int, Dict[str, Union[bool, List[str], S
 
 # Init word variables
 
-for word_type in regex:
-    locals()[f"{word_type}_words"]: Dict[str, Dict[str, Union[float, int]]] = {}
-
-# type_words = {
-#     "regex": 0
+rules: RuleRegistry = RuleRegistry(regex)
+
+# rules.get("type") = {
+#     "words": {"regex": 0},
+#     "rules": {"regex": re.compile("regex", re.I | re.M | re.S)},
+#     "names": ["regex"],
+#     "index": {"r": [0]},
+#     "always": [],
+#     "spaceless": {0},
+#     "literals": {"regex": [0]},
+#     "unfiltered": set(),
+#     "nocr": set(),
+#     "chars": frozenset(),
+#     "classes": {},
+#     "generation": 1,
+#     "special": {}
 # }
 
 # Load data
@@ -657,37 +830,42 @@ for file in file_list:
         try:
             if exists(f"data/{file}") or exists(f"data/.{file}"):
                 with open(f"data/{file}", "rb") as f:
-                    locals()[f"{file}"] = pickle.load(f)
+                    file_data = pickle.load(f)
             else:
+                file_data = None
+
                 with open(f"data/{file}", "wb") as f:
-                    pickle.dump(eval(f"{file}"), f)
+                    pickle.dump(rules.get_words(file[:-6]) if file.endswith("_words") else eval(f"{file}"), f)
         except Exception as e:
             logger.error(f"Load data {file} error: {e}", exc_info=True)
 
             with open(f"data/.{file}", "rb") as f:
-                locals()[f"{file}"] = pickle.load(f)
+                file_data = pickle.load(f)
     except Exception as e:
         logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
         raise SystemExit("[DATA CORRUPTION]")
 
-# Generate special characters dictionary
-for special in ["spc", "spe"]:
-    locals()[f"{special}_dict"]: Dict[str, str] = {}
+    if file_data is None:
+        continue
+
+    # Compile the regex rules
+    if file.endswith("_words"):
+        rules.update(file[:-6], file_data)
+    else:
+        locals()[f"{file}"] = file_data
 
-    for rule in locals()[f"{special}_words"]:
-        # Check keys
-        if "[" not in rule:
-            continue
+# Load the Chinese converter once, each new converter reads its config again
+opencc: Optional[OpenCC] = (zh_cn and OpenCC("t2s.json")) or None
 
-        # Check value
-        if "?#" not in rule:
-            continue
+# Load language detection profiles
+detector_factory: DetectorFactory = DetectorFactory()
+detector_factory.load_profile(PROFILES_DIRECTORY)
+detector_factory.set_seed(0)
 
-        keys = rule.split("]")[0][1:]
-        value = rule.split("?#")[1][1]
+detector_pool: Queue = Queue(maxsize=8)
 
-        for k in keys:
-            locals()[f"{special}_dict"][k] = value
+for _ in range(4):
+    detector_pool.put(detector_factory.create())
 
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>\n"
@@ -22,13 +22,13 @@ from pyrogram import Client, Filters, Message
 
 from .. import glovar
 from ..functions.channel import get_content, get_debug_text
-from ..functions.etc import code, delay, general_link, get_filename, get_forward_name, get_full_name, get_now, get_text
-from ..functions.etc import lang, mention_id, t2t, thread
+from ..functions.etc import code, delay, general_link, get_detections, get_filename, get_forward_name, get_full_name
+from ..functions.etc import get_now, get_text, get_tier, init_fields, lang, mention_id, t2t, thread, update_tier
 from ..functions.file import save
 from ..functions.filters import aio, authorized_group, class_c, class_d, class_e, declared_message, exchange_channel
 from ..functions.filters import from_user, hide_channel, is_ban_text, is_class_d_user, is_declared_message
 from ..functions.filters import is_detected_url, is_in_config, is_nm_text, is_not_allowed, is_regex_text
-from ..functions.filters import new_group, test_group
+from ..functions.filters import new_group, prefetch_join, prefetch_message, test_group
 from ..functions.group import leave_group
 from ..functions.ids import init_group_id, init_user_id
 from ..functions.receive import receive_add_bad, receive_add_except, receive_captcha_flood, receive_captcha_kicked_user
@@ -53,6 +53,12 @@ logger = logging.getLogger(__name__)
 def check(client: Client, message: Message) -> bool:
     # Check the messages sent from groups
 
+    update_tier(client, message)
+    init_fields()
+
+    # Run the detections and the scans before taking the lock, so the checks in different threads do not wait for them
+    prefetch_message(client, message)
+
     has_text = bool(message and (message.text or message.caption))
 
     if has_text:
@@ -137,6 +143,8 @@ def check(client: Client, message: Message) -> bool:
         else:
             glovar.locks["message"].release()
 
+        init_fields(False)
+
     return False
 
 
@@ -146,12 +154,26 @@ def check(client: Client, message: Message) -> bool:
                    & ~declared_message)
 def check_join(client: Client, message: Message) -> bool:
     # Check new joined user
+    update_tier(client, message)
+    init_fields()
+
+    # Get the bios and run the detections before taking the lock
+    bios = prefetch_join(client, message)
+
     glovar.locks["message"].acquire()
     try:
         # Basic data
         gid = message.chat.id
         now = message.date or get_now()
 
+        # The languages of the enabled checks
+        tier = get_tier(gid)
+        wanted = set()
+
+        for the_type in ["name", "bio"]:
+            if is_in_config(gid, the_type):
+                wanted |= set(glovar.configs[gid][the_type]["list"])
+
         for new in message.new_chat_members:
             # Basic data
             uid = new.id
@@ -164,22 +186,30 @@ def check_join(client: Client, message: Message) -> bool:
             if is_declared_message(None, message):
                 return True
 
-            # Check name
+            # Get name and bio
             name = get_full_name(new)
 
             if not name or name in glovar.except_ids["long"]:
                 continue
 
-            the_lang = is_in_config(gid, "name", name)
+            bio = bios[uid] if uid in bios else get_user_bio(client, uid)
+
+            if bio in glovar.except_ids["long"]:
+                bio = ""
+
+            # Detect the enabled checks' texts at once
+            texts = [name if is_in_config(gid, "name") else "", bio if is_in_config(gid, "bio") else ""]
+            detections = get_detections(texts, tier, wanted) if wanted else {}
+
+            # Check name
+            the_lang = is_in_config(gid, "name", name, detections)
             the_lang and terminate_user(client, message, new, f"name {the_lang}")
 
             # Check bio
-            bio = get_user_bio(client, uid)
-
-            if not bio or bio in glovar.except_ids["long"]:
+            if not bio:
                 return True
 
-            the_lang = is_in_config(gid, "bio", bio)
+            the_lang = is_in_config(gid, "bio", bio, detections)
             the_lang and terminate_user(client, message, new, f"bio {the_lang} {bio}")
 
             # Init the user's status
@@ -195,6 +225,7 @@ def check_join(client: Client, message: Message) -> bool:
         logger.warning(f"Check join error: {e}", exc_info=True)
     finally:
         glovar.locks["message"].release()
+        init_fields(False)
 
     return False
 